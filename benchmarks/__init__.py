@@ -0,0 +1,3 @@
+"""
+Benchmarks of psaw against a local mock PushShift server. See :mod:`benchmarks.run`.
+"""
@@ -0,0 +1,225 @@
+"""
+Local stand-in for the PushShift API, serving synthetic comments and submissions.
+
+Supports ``/meta`` and ``/reddit/{kind}/search`` with the paging arguments psaw uses (``after``,
+``before``, ``sort``, ``limit``, ``filter``, ``ids``, ``author`` and ``subreddit``). Things are
+generated from a fixed seed, so every run serves the same data. Pages can be delayed to mimic
+network latency, and the metadata can report shards as down.
+
+Run standalone with ``python -m benchmarks.mock_server --port 8080``.
+"""
+import argparse
+import bisect
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+T0 = 1500000000
+
+_search_path = re.compile(r'^/reddit/(\w+)/search/?$')
+
+
+def make_things(n_items, body_size=200, per_second=3, seed=0):
+    """
+    Synthetic things in ascending ``created_utc`` order
+
+    :param n_items: int
+    :param body_size: int
+        length of each body
+    :param per_second: int
+        things created in each second, so that pages end mid-second
+    :param seed: int
+    :return: list of dict
+    """
+    rng = random.Random(seed)
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit']
+    things = []
+    for i in range(n_items):
+        body = ' '.join(rng.choice(words) for _ in range(body_size // 5 + 1))[:body_size]
+        things.append({
+            'id': format(i + 36**5, 'x'),
+            'created_utc': T0 + i // per_second,
+            'author': 'user{}'.format(rng.randrange(1000)),
+            'subreddit': 'sub{}'.format(rng.randrange(50)),
+            'score': rng.randrange(-10, 1000),
+            'body': body,
+            'link_id': 't3_{:x}'.format(rng.randrange(36**5)),
+            'permalink': '/r/x/comments/{:x}/'.format(i),
+            'edited': False,
+            'stickied': False,
+            'gilded': 0,
+        })
+    return things
+
+
+class MockPushshift(object):
+    """
+    Local server answering PushShift search requests from synthetic data.
+
+    :param n_items: Number of things served, defaults to 100000.
+    :type n_items: int, optional
+
+    :param body_size: Length of each thing's body, defaults to 200.
+    :type body_size: int, optional
+
+    :param latency: Seconds to wait before answering each request, defaults to 0.
+    :type latency: float, optional
+
+    :param shards_down: Report one of the shards as down in every response, defaults to False.
+    :type shards_down: bool, optional
+
+    :param rate_limit_per_minute: Rate limit reported by ``/meta``, defaults to 1000000.
+    :type rate_limit_per_minute: int, optional
+    """
+    def __init__(self, n_items=100000, body_size=200, latency=0, shards_down=False,
+                 rate_limit_per_minute=1000000):
+        self.latency = latency
+        self.shards_down = shards_down
+        self.rate_limit_per_minute = rate_limit_per_minute
+        self.things = make_things(n_items, body_size)
+        # Responses are assembled from pre-encoded things, so serving costs little CPU.
+        self.encoded = [json.dumps(thing) for thing in self.things]
+        self.created = [thing['created_utc'] for thing in self.things]
+        self.positions = {thing['id']: i for i, thing in enumerate(self.things)}
+        self.requests = 0
+        self.server = None
+
+    def _select(self, args):
+        """Indices of the things matching a search, in the requested order"""
+        get = lambda key: args.get(key, [None])[0]
+        if get('ids'):
+            ids = ','.join(args['ids']).split(',')
+            indices = sorted(self.positions[id] for id in ids if id in self.positions)
+        else:
+            start, end = 0, len(self.things)
+            if get('after'):
+                start = bisect.bisect_right(self.created, int(get('after')))
+            if get('before'):
+                end = bisect.bisect_left(self.created, int(get('before')))
+            indices = range(start, max(start, end))
+        for key in ('author', 'subreddit'):
+            if get(key):
+                values = set(','.join(args[key]).split(','))
+                indices = [i for i in indices if self.things[i][key] in values]
+        if get('sort') != 'asc':
+            indices = indices[::-1]
+        return indices
+
+    def search(self, args):
+        """
+        Response body for a search
+
+        :param args: dict
+            query arguments, each a list of values
+        :return: bytes
+        """
+        indices = self._select(args)
+        limit = int(args.get('limit', [25])[0])
+        page = indices[:limit]
+        fields = args.get('filter')
+        if fields:
+            fields = set(','.join(fields).split(','))
+            data = [json.dumps({k: v for k, v in self.things[i].items() if k in fields}) for i in page]
+        else:
+            data = [self.encoded[i] for i in page]
+        metadata = {
+            'size': len(page),
+            'total_results': len(indices),
+            'shards': {'successful': 7 if self.shards_down else 8, 'total': 8, 'failed': 0},
+        }
+        return '{{"data": [{}], "metadata": {}}}'.format(', '.join(data), json.dumps(metadata)).encode('utf8')
+
+    def meta(self):
+        return json.dumps({'server_ratelimit_per_minute': self.rate_limit_per_minute}).encode('utf8')
+
+    def start(self, port=0):
+        """
+        Serve from a background daemon thread
+
+        :param port: int
+            0 to pick a free port
+        :return: str
+            base url template to set as ``PushshiftAPIMinimal._base_url``
+        """
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self.server.daemon_threads = True
+        self.server.mock = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return 'http://127.0.0.1:{}/{{{{endpoint}}}}'.format(self.server.server_address[1])
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        mock = self.server.mock
+        mock.requests += 1
+        url = urlparse(self.path)
+        if mock.latency:
+            time.sleep(mock.latency)
+        if url.path.rstrip('/') == '/meta':
+            return self._send(mock.meta())
+        if _search_path.match(url.path):
+            return self._send(mock.search(parse_qs(url.query)))
+        self._send(b'{"error": "not found"}', status=404)
+
+    def _send(self, body, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve(urls, kwargs):
+    mock = MockPushshift(**kwargs)
+    urls.put(mock.start())
+    threading.Event().wait()
+
+
+def start_in_process(**kwargs):
+    """
+    Run a :class:`MockPushshift` in a child process, so that serving doesn't compete with the
+    code being measured for the GIL
+
+    :param kwargs: arguments for :class:`MockPushshift`
+    :return: str, multiprocessing.Process
+        base url template, and the process to ``terminate()`` when done
+    """
+    urls = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(urls, kwargs), daemon=True)
+    process.start()
+    return urls.get(timeout=120), process
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--body-size', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--shards-down', action='store_true')
+    args = parser.parse_args()
+    mock = MockPushshift(n_items=args.items, body_size=args.body_size, latency=args.latency,
+                         shards_down=args.shards_down)
+    mock.start(args.port)
+    print('serving {} things at http://127.0.0.1:{}/'.format(args.items, mock.server.server_address[1]))
+    threading.Event().wait()
+
+
+if __name__ == '__main__':
+    main()
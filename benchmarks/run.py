@@ -0,0 +1,397 @@
+"""
+Benchmarks of psaw's own overhead, run against a local mock PushShift server.
+
+Measures items per second, time to first item and peak memory for searches, parallel searches
+against a server with latency, ``_wrap_thing``, each writer in :mod:`psaw.writers` and the CLI
+end to end. Results are written as JSON, and can be
+compared with those of an earlier run to catch regressions::
+
+    python -m benchmarks.run --output before.json
+    # ...change things...
+    python -m benchmarks.run --output after.json --compare before.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import psaw
+from psaw import PushshiftAPI, PushshiftAPIMinimal
+from psaw import writers as wt
+
+from .mock_server import T0, make_things, start_in_process
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Run in a child process by the cli benchmark, pointing psaw at the mock server.
+_cli_script = (
+    "import sys\n"
+    "from psaw import PushshiftAPIMinimal\n"
+    "PushshiftAPIMinimal._base_url = sys.argv[1]\n"
+    "from psaw.psaw import cli\n"
+    "cli(sys.argv[2:])\n"
+)
+
+# Run in a child process by the startup benchmarks, printing seconds taken to import psaw and,
+# if a url is given, to construct a client and receive the first item of a search.
+_startup_script = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import {module}\n"
+    "imported = time.perf_counter()\n"
+    "first = None\n"
+    "if len(sys.argv) > 1:\n"
+    "    from psaw import PushshiftAPI, PushshiftAPIMinimal\n"
+    "    PushshiftAPIMinimal._base_url = sys.argv[1]\n"
+    "    api = PushshiftAPI(meta_cache_dir=sys.argv[2], shards_down_behavior=None)\n"
+    "    next(api.search_comments(limit=1))\n"
+    "    first = time.perf_counter()\n"
+    "print(imported - start, None if first is None else first - start)\n"
+)
+
+
+def _api(url, **kwargs):
+    PushshiftAPIMinimal._base_url = url
+    kwargs.setdefault('rate_limit_per_minute', 10**6)
+    kwargs.setdefault('shards_down_behavior', None)
+    return PushshiftAPI(**kwargs)
+
+
+def measure(run, repeat=3, memory=True):
+    """
+    Time `run`, a callable taking a `first` callback to call when its first item is ready and
+    returning the number of items processed. The fastest of `repeat` runs is kept, then
+    `run` is repeated once under tracemalloc for its peak memory use.
+
+    :param run: callable
+    :param repeat: int
+    :param memory: bool
+    :return: dict
+    """
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        first = []
+        start = time.perf_counter()
+        items = run(lambda: first or first.append(time.perf_counter()))
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best['seconds']:
+            best = {
+                'items': items,
+                'seconds': seconds,
+                'items_per_sec': items / seconds if seconds else None,
+                'first_item_seconds': first[0] - start if first else None,
+            }
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run(lambda: None)
+            best['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best
+
+
+def search_benchmarks(url, shards_down_url, n_items, **api_kwargs):
+    """
+    Searches through the whole mock dataset, keyed by benchmark name. `shards_down_url` is that
+    of a server reporting shards as down.
+    """
+    def search(first, url=url, **kwargs):
+        api = _api(url, **dict(api_kwargs, **kwargs.pop('api', {})))
+        n = 0
+        for thing in api.search_comments(limit=n_items, **kwargs):
+            if not n:
+                first()
+            n += len(thing) if isinstance(thing, list) else 1
+        api.close()
+        return n
+
+    return {
+        'search': search,
+        'search_stream': lambda first: search(first, api={'stream_responses': True}),
+        'search_exact': lambda first: search(first, api={'exact_paging': True}),
+        'search_raw': lambda first: search(first, return_batch='raw'),
+        'search_prefetch': lambda first: search(first, prefetch=2),
+        'search_shards_down': lambda first: search(first, url=shards_down_url,
+                                                   api={'shards_down_behavior': 'warn'}),
+    }
+
+
+def parallel_benchmarks(url, n_items, workers=(1, 4, 8)):
+    """
+    Searches through the whole mock dataset paged by each number of `workers`, keyed by
+    benchmark name. Run against a server with latency, since that is what workers overlap.
+    """
+    # Small pages, so that there are many to overlap. The mock creates 3 things a second.
+    def search(first, n_workers):
+        api = _api(url, max_results_per_request=100)
+        n = 0
+        for _ in api.search_comments(limit=n_items, after=T0 - 1, before=T0 + n_items // 3 + 1,
+                                     workers=n_workers):
+            if not n:
+                first()
+            n += 1
+        api.close()
+        return n
+
+    return {'search_parallel_{}'.format(n): lambda first, n=n: search(first, n) for n in workers}
+
+
+def archive_benchmark(url, directory, n_items):
+    """Searches answered by :class:`psaw.LocalPushshiftAPI` from an archive synced from the mock server"""
+    from psaw.archive import Archive, LocalPushshiftAPI
+
+    archive = Archive(os.path.join(directory, 'archive.sqlite'))
+    archive.sync(_api(url, exact_paging=True), 'comment')
+
+    def run(first):
+        api = LocalPushshiftAPI(archive)
+        n = 0
+        for _ in api.search_comments(limit=n_items):
+            if not n:
+                first()
+            n += 1
+        return n
+    return run
+
+
+def wrap_benchmark(things):
+    """_wrap_thing over copies of `things`"""
+    api = PushshiftAPIMinimal(rate_limit_per_minute=10**6, utc_offset_secs=0)
+
+    def run(first):
+        for thing in things:
+            api._wrap_thing(dict(thing), 'comment')
+            first()
+        return len(things)
+    return run
+
+
+def writer_benchmarks(things, directory):
+    """Each writer writing `things` to a file in `directory`, keyed by benchmark name"""
+    fields = list(things[0])
+    writers = {
+        'json': (wt.JsonBatchWriter, {}, 'json'),
+        'csv': (wt.CsvBatchWriter, {}, 'csv'),
+        'ndjson': (wt.NdjsonWriter, {}, 'ndjson'),
+        'ndjson_gzip': (wt.NdjsonWriter, {}, 'ndjson.gz'),
+        'ndjson_sharded': (wt.NdjsonWriter, {'max_records': len(things) // 4 + 1}, '{shard}.ndjson'),
+    }
+    try:
+        import pyarrow
+        writers['parquet'] = (wt.ParquetWriter, {}, 'parquet')
+        writers['arrow'] = (wt.ArrowWriter, {}, 'arrow')
+    except ImportError:
+        pass
+
+    def run(cls, kwargs, extension, mode, first):
+        writer = cls(fields, **kwargs)
+        if mode != 'write':
+            writer = wt.BufferedWriter(writer, background=mode == 'background')
+        writer.open(os.path.join(directory, 'out.{}'.format(extension)))
+        writer.header()
+        for thing in things:
+            writer.write(thing)
+            first()
+        writer.footer()
+        writer.close()
+        return len(things)
+
+    benchmarks = {}
+    for name, (cls, kwargs, extension) in writers.items():
+        for mode in ('write', 'buffered', 'background'):
+            benchmarks['writer_{}_{}'.format(name, mode)] = (
+                lambda first, args=(cls, kwargs, extension, mode): run(*args, first=first))
+    return benchmarks
+
+
+def cli_benchmark(url, n_items, directory, format='csv', repeat=3):
+    """The psaw CLI end to end in a child process, including interpreter startup"""
+    output = os.path.join(directory, 'cli.{}'.format(format))
+    args = [sys.executable, '-c', _cli_script, url, 'comments', '-l', str(n_items),
+            '-o', output, '--format', format]
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best['seconds']:
+            best = {'items': n_items, 'seconds': seconds, 'items_per_sec': n_items / seconds,
+                    'first_item_seconds': None}
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        best['peak_memory_bytes'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return best
+
+
+def startup_benchmarks(url, directory, repeat=3):
+    """
+    Time to import psaw, to import the CLI, and to receive the first item of a search by a new
+    client, both fetching the server's rate limit from /meta and reading it from the on-disk
+    copy saved by an earlier process. Each is run in a fresh child process, and the fastest of
+    `repeat` runs is kept.
+    """
+    def run(module='psaw', cold=False, cached=False):
+        cache_dir = os.path.join(directory, 'meta-cache')
+        args = [sys.executable, '-c', _startup_script.format(module=module)]
+        if cold or cached:
+            args += [url, cache_dir]
+        best = None
+        for _ in range(repeat):
+            if cold:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+            output = subprocess.run(args, check=True, stdout=subprocess.PIPE).stdout.split()
+            seconds = float(output[1] if output[1] != b'None' else output[0])
+            if best is None or seconds < best['seconds']:
+                best = {'items': 1, 'seconds': seconds, 'items_per_sec': 1 / seconds,
+                        'first_item_seconds': seconds if cold or cached else None}
+        return best
+
+    return {
+        'startup_import': lambda: run(),
+        'startup_import_cli': lambda: run(module='psaw.psaw'),
+        'startup_first_item': lambda: run(cold=True),
+        'startup_first_item_cached_meta': lambda: run(cached=True),
+    }
+
+
+def environment():
+    return {
+        'psaw_version': psaw.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'timestamp': int(time.time()),
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Print items/sec of `results` relative to `baseline`, returning the names of benchmarks
+    that slowed down by more than `threshold`
+
+    :param results: dict
+    :param baseline: dict
+    :param threshold: float
+    :return: list[str]
+    """
+    regressions = []
+    print('{:<40} {:>14} {:>14} {:>8}'.format('benchmark', 'baseline/s', 'items/s', 'change'))
+    for name, result in sorted(results['results'].items()):
+        old = baseline['results'].get(name)
+        if not old or not old.get('items_per_sec') or not result.get('items_per_sec'):
+            continue
+        change = result['items_per_sec'] / old['items_per_sec'] - 1
+        flag = ''
+        if change < -threshold:
+            regressions.append(name)
+            flag = ' REGRESSION'
+        print('{:<40} {:>14,.0f} {:>14,.0f} {:>+7.1%}{}'.format(
+            name, old['items_per_sec'], result['items_per_sec'], change, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark psaw against a local mock PushShift server.")
+    parser.add_argument('--items', type=int, default=50000, help="things searched for and written")
+    parser.add_argument('--body-size', type=int, default=200, help="length of each thing's body")
+    parser.add_argument('--latency', type=float, default=0, help="seconds the mock server waits per request")
+    parser.add_argument('--parallel-latency', type=float, default=0.05,
+                        help="seconds the mock server waits per request in the search_parallel benchmarks")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per benchmark, the fastest is kept")
+    parser.add_argument('--only', help="comma separated benchmark name prefixes to run, eg search,writer_csv")
+    parser.add_argument('--output', help="file to write results to as JSON")
+    parser.add_argument('--compare', help="results of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="slowdown in items/s, as a fraction, reported as a regression")
+    args = parser.parse_args(argv)
+
+    only = args.only.split(',') if args.only else None
+    selected = lambda name: only is None or any(name.startswith(prefix) for prefix in only)
+    config = {'items': args.items, 'body_size': args.body_size, 'latency': args.latency,
+              'parallel_latency': args.parallel_latency, 'repeat': args.repeat}
+    results = {'environment': environment(), 'config': config, 'results': {}}
+
+    def record(name, result):
+        results['results'][name] = result
+        print('{:<40} {:>10} items/s  first {:>8}  peak {:>8} KiB'.format(
+            name,
+            '{:,.0f}'.format(result['items_per_sec']),
+            '-' if result['first_item_seconds'] is None else '{:.4f}s'.format(result['first_item_seconds']),
+            '{:,.0f}'.format(result.get('peak_memory_bytes', 0) / 1024)))
+
+    server_args = dict(n_items=args.items, body_size=args.body_size, latency=args.latency)
+    url, server = start_in_process(**server_args)
+    shards_down_url, shards_down_server = start_in_process(shards_down=True, **server_args)
+    directory = tempfile.mkdtemp(prefix='psaw-bench-')
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for name, run in search_benchmarks(url, shards_down_url, args.items).items():
+                if selected(name):
+                    record(name, measure(run, args.repeat))
+
+        parallel = [name for name in parallel_benchmarks(None, args.items) if selected(name)]
+        if parallel:
+            slow_url, slow_server = start_in_process(**dict(server_args, latency=args.parallel_latency))
+            try:
+                # 100 pages: enough to overlap, and serial paging still takes seconds, not minutes
+                for name, run in parallel_benchmarks(slow_url, min(args.items, 10000)).items():
+                    if name in parallel:
+                        record(name, measure(run, args.repeat))
+            finally:
+                slow_server.terminate()
+
+        if selected('search_archive'):
+            record('search_archive', measure(archive_benchmark(url, directory, args.items), args.repeat))
+
+        things = make_things(args.items, args.body_size)
+        if selected('wrap_thing'):
+            record('wrap_thing', measure(wrap_benchmark(things), args.repeat))
+
+        for name, run in writer_benchmarks(things, directory).items():
+            if selected(name):
+                record(name, measure(run, args.repeat))
+
+        for name, run in startup_benchmarks(url, directory, repeat=max(args.repeat, 5)).items():
+            if selected(name):
+                record(name, run())
+
+        if selected('cli'):
+            record('cli_csv', cli_benchmark(url, args.items, directory, repeat=args.repeat))
+    finally:
+        server.terminate()
+        shards_down_server.terminate()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, encoding='utf8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('{} benchmarks regressed by more than {:.0%}'.format(len(regressions), args.threshold))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
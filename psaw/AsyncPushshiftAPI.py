@@ -0,0 +1,342 @@
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import copy
+import functools
+import logging
+import time
+import warnings
+
+from .PushshiftAPI import PushshiftAPIMinimal, RateLimitCache, _WINDOW_DONE, _chunked, _ExactCursor, _id_payload, _require_fields, _sort_by_ids
+from .adaptive import AdaptiveRateLimiter, is_retryable, parse_retry_after
+from .decoding import loads, page_tail
+from .transport import request_key
+
+log = logging.getLogger(__name__)
+
+
+class AsyncRateLimiter(object):
+    """
+    Awaitable counterpart to :meth:`RateLimitCache.acquire`. Waiting callers sleep on the
+    event loop instead of blocking it. Shared limiters, which take a file lock or a round trip
+    to a server to grant a request, are asked from a worker thread.
+
+    :param rlcache: Rate limit state to enforce, e.g. a :class:`RateLimitCache` or one of the
+        shared limiters in :mod:`psaw.ratelimit`.
+    """
+    def __init__(self, rlcache):
+        self.rlcache = rlcache
+        self._lock = None
+
+    async def acquire(self):
+        # Created lazily so the lock binds to the loop that actually uses it.
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        in_process = isinstance(self.rlcache, (RateLimitCache, AdaptiveRateLimiter))
+        async with self._lock:
+            while True:
+                if in_process:
+                    interval = self.rlcache.try_acquire()
+                else:
+                    interval = await asyncio.get_running_loop().run_in_executor(None, self.rlcache.try_acquire)
+                if interval == 0:
+                    return
+                log.debug("Imposing rate limit, sleeping for %s" % interval)
+                await asyncio.sleep(interval)
+
+
+class AsyncPushshiftAPI(PushshiftAPIMinimal):
+    def __init__(self, max_in_flight=10, **kwargs):
+        """
+        asyncio client for the PushShift API. Search methods are async generators, so many
+        queries can be multiplexed on a single event loop.
+
+        :param max_in_flight: Maximum number of requests awaiting a response at any one time, defaults to 10.
+        :type max_in_flight: int, optional
+
+        Remaining keyword arguments are the same as for :class:`PushshiftAPI`.
+        """
+        kwargs.setdefault('pool_size', max_in_flight)
+        super().__init__(**kwargs)
+        self.max_in_flight = max_in_flight
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._rate_limiter = AsyncRateLimiter(self._rlcache)
+        self._in_flight = None
+        self._meta_lock = None
+
+    async def _resolve_rate_limit(self):
+        if self._meta_lock is None:
+            self._meta_lock = asyncio.Lock()
+        async with self._meta_lock:
+            if not self._meta_pending:
+                return
+            response = self._load_meta()
+            if response is None:
+                log.debug("Connecting to /meta endpoint to learn rate limit.")
+                response = loads((await self._request(self.base_url.format(endpoint='meta'), {})).content)
+                self._save_meta(response)
+            self._rlcache.n = response['server_ratelimit_per_minute']
+            log.debug("server_ratelimit_per_minute: %s" % self._rlcache.n)
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+        self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _request(self, url, payload):
+        if self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        loop = asyncio.get_event_loop()
+        i, success, retry_after = 0, False, None
+        while (not success) and (i<self.max_retries):
+            if i > 0:
+                warnings.warn("Unable to connect to pushshift.io. Retrying after backoff.")
+                self.metrics.incr('retries_total')
+                interval = self._backoff_interval(i, retry_after)
+                log.debug("Backing off, sleeping for %s" % interval)
+                await asyncio.sleep(interval)
+                self.metrics.incr('backoff_seconds_total', interval)
+            limited = not self._meta_pending
+            if limited:
+                start = time.time()
+                await self._rate_limiter.acquire()
+                self.metrics.incr('rate_limit_wait_seconds_total', time.time() - start)
+            i+=1
+            response, start = None, time.time()
+            try:
+                async with self._in_flight:
+                    response = await loop.run_in_executor(
+                        self._executor,
+                        functools.partial(self.transport.get, url, params=payload))
+                log.info(response.url)
+                log.debug('Response status code: %s' % response.status_code)
+            except self.transport.connection_errors:
+                log.debug("Connection error caught, retrying. Connection attempts so far: %s" % str(i+1))
+                continue
+            finally:
+                if limited:
+                    self._observe(response, time.time() - start)
+            success = response.status_code == 200
+            if not success:
+                warnings.warn("Got non 200 code %s" % response.status_code)
+                if not is_retryable(response.status_code):
+                    raise Exception("Request to pushshift.io failed with non-retryable code %s." % response.status_code)
+                retry_after = parse_retry_after(response.headers)
+        if not success:
+            raise Exception("Unable to connect to pushshift.io. Max retries exceeded.")
+        return response
+
+    async def _in_executor(self, func, *args, **kwargs):
+        """Run blocking `func` on the executor rather than the event loop."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _get(self, url, payload={}):
+        log.debug('URL: %s' % url)
+        log.debug('Payload: %s' % payload)
+        # Cache lookups are SQLite queries, and a page can take a while to parse, so neither
+        # runs on the event loop.
+        if self.cache is not None:
+            key = request_key(url, payload)
+            body = await self._in_executor(self.cache.get, key)
+            if body is not None:
+                self.metrics.incr('cache_hits_total')
+                return await self._in_executor(self._decode, body)
+        if self._meta_pending:
+            await self._resolve_rate_limit()
+        response = await self._request(url, payload)
+        if self.cache is not None:
+            await self._in_executor(self.cache.set, key, response.content, ttl=self._cache_ttl(payload))
+        return await self._in_executor(self._decode, response.content)
+
+    async def _handle_paging(self, url, payload):
+        limit = payload.get('limit', None)
+        exact = _ExactCursor() if self.exact_paging and not self._limited(payload) else None
+        while True:
+            if limit is not None:
+                if limit > self.max_results_per_request:
+                    payload['limit'] = self.max_results_per_request
+                    limit -= self.max_results_per_request
+                else:
+                    payload['limit'] = limit
+                    limit = 0
+            self._add_nec_args(payload)
+
+            if exact is None:
+                data = await self._get(url, payload)
+                n_results, last = page_tail(data.get('data', []))
+                self._advance_cursor(payload, last)
+                exhausted = n_results == 0
+            else:
+                request = exact.request(payload, self.max_results_per_request)
+                data = await self._get(url, request)
+                exhausted = exact.advance(payload, request, data)
+            if exhausted:
+                yield data
+                return
+            if exact is None or data['data']:
+                yield data
+            if limit is not None:
+                if exact is None:
+                    received_size = int(data['metadata']['size'])
+                else:
+                    received_size = len(data['data'])
+                requested_size = payload['limit']
+                if received_size < requested_size:
+                    limit += requested_size - received_size
+
+                if limit == 0:
+                    return
+
+    async def _fetch_ids(self, url, payload, ids, ordered):
+        response = await self._get(url, _id_payload(payload, ids))
+        if ordered:
+            _sort_by_ids(response['data'], ids)
+        return response
+
+    async def _handle_id_lookup(self, url, payload, ordered=False):
+        # Concurrency is bounded by max_in_flight, so only read that many chunks ahead.
+        pending = deque()
+        try:
+            for chunk in _chunked(payload['ids'], self.max_results_per_request):
+                pending.append(asyncio.ensure_future(self._fetch_ids(url, payload, chunk, ordered)))
+                if len(pending) >= self.max_in_flight:
+                    yield await self._next_completed(pending, ordered)
+            while pending:
+                yield await self._next_completed(pending, ordered)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @staticmethod
+    async def _next_completed(pending, ordered):
+        if ordered:
+            task = pending.popleft()
+        else:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            task = next(iter(done))
+            pending.remove(task)
+        return await task
+
+    async def _prefetch(self, pages, prefetch):
+        """Keep up to `prefetch` pages from `pages` ready ahead of the consumer."""
+        q = asyncio.Queue(maxsize=prefetch)
+
+        async def produce():
+            try:
+                async for page in pages:
+                    await q.put(page)
+            except Exception as e:
+                await q.put(e)
+            await q.put(_WINDOW_DONE)
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                item = await q.get()
+                if item is _WINDOW_DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            producer.cancel()
+
+    async def _search(self,
+                      kind,
+                      stop_condition=lambda x: False,
+                      return_batch=False,
+                      dataset='reddit',
+                      dedupe=None,
+                      ordered=False,
+                      prefetch=None,
+                      **kwargs):
+        # Unlike the synchronous client, paging state is kept local to each
+        # query so concurrent searches on one instance don't interfere.
+        ids = kwargs.pop('ids', None)
+        payload = copy.deepcopy(kwargs)
+        if dedupe is not None:
+            _require_fields(payload, 'id')
+        endpoint = '{dataset}/{kind}/search'.format(dataset=dataset, kind=kind)
+        url = self.base_url.format(endpoint=endpoint)
+        if ids is not None:
+            payload['ids'] = ids
+            responses = self._handle_id_lookup(url, payload, ordered)
+        else:
+            responses = self._handle_paging(url, payload)
+            if prefetch and not self._limited(payload):
+                responses = self._prefetch(responses, prefetch)
+        async for response in responses:
+            if 'aggs' in response:
+                yield response['aggs']
+                payload.pop('aggs', None)
+            results = response['data']
+            self._update_metadata(response)
+
+            if len(results) == 0:
+                # An empty chunk of ids (e.g. all deleted) doesn't mean the later chunks are empty too.
+                if ids is not None:
+                    continue
+                return
+            if dedupe is not None:
+                results = [thing for thing in results if dedupe.add(thing['id'])]
+                if not results:
+                    continue
+            if isinstance(return_batch, str):
+                start = time.time()
+                batch, stopped = self._format_batch(results, return_batch, stop_condition)
+                self.metrics.incr('wrap_seconds_total', time.time() - start)
+                yield batch
+                if stopped:
+                    return
+                continue
+            batch = []
+            wrap_seconds = 0
+            try:
+                for thing in results:
+                    start = time.time()
+                    thing = self._wrap_thing(thing, kind)
+                    wrap_seconds += time.time() - start
+
+                    if return_batch:
+                        batch.append(thing)
+                    else:
+                        yield thing
+
+                    if stop_condition(thing):
+                        if return_batch:
+                            yield batch
+                        return
+            finally:
+                self.metrics.incr('wrap_seconds_total', wrap_seconds)
+
+            if return_batch:
+                yield batch
+
+    def search_comments(self, **kwargs):
+        return self._search(kind='comment', **kwargs)
+
+    def search_submissions(self, **kwargs):
+        return self._search(kind='submission', **kwargs)
+
+    async def redditor_subreddit_activity(self, author, **kwargs):
+        """
+        :param author: Redditor to be profiled
+        :type author: str
+        """
+        async def activity(kind):
+            gen = self._search(kind=kind, author=author, aggs='subreddit', **kwargs)
+            try:
+                agg = await gen.__anext__()
+            finally:
+                await gen.aclose()
+            return Counter({rec['key']:rec['doc_count'] for rec in agg['subreddit']})
+
+        kinds = ('comment', 'submission')
+        counters = await asyncio.gather(*(activity(k) for k in kinds))
+        return dict(zip(kinds, counters))
@@ -1,12 +1,25 @@
 from collections import namedtuple, deque, Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import copy
+import functools
 import json
 import logging
-import requests
+import os
+import queue
+import random
+import re
+import threading
 import time
 from datetime import datetime as dt
+from itertools import islice
 import warnings
 
+from .adaptive import AdaptiveRateLimiter, is_retryable, parse_retry_after
+from .decoding import loads, page_tail, StreamedItems, StreamedResponse
+from .metrics import Metrics
+from .planner import CrawlPlan, histogram_buckets
+from .transport import RequestsTransport, request_key
+
 log = logging.getLogger(__name__)
 
 class RateLimitCache(object):
@@ -14,6 +27,7 @@ class RateLimitCache(object):
         self.n = n
         self.t = t
         self.cache = deque()
+        self._lock = threading.Lock()
     @property
     def delta(self):
         """Time since earliest call"""
@@ -43,6 +57,334 @@ class RateLimitCache(object):
         if self.blocked:
             raise Exception("RateLimitCache is blocked.")
         self.cache.append(time.time())
+    def try_acquire(self):
+        """Record a call if one is permitted and return 0, else return seconds to wait before trying again."""
+        with self._lock:
+            if not self.blocked:
+                self.cache.append(time.time())
+                return 0
+            return max(self.interval, 1e-3)
+    def acquire(self):
+        """Block until a call is permitted, then record it. Safe to share across threads."""
+        while True:
+            interval = self.try_acquire()
+            if interval == 0:
+                return
+            log.debug("Imposing rate limit, sleeping for %s" % interval)
+            time.sleep(interval)
+
+
+def _default_cache_dir():
+    """Per-user cache directory shared by every psaw process, following XDG conventions."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'psaw')
+
+
+_relative_time = re.compile(r'^([0-9]+)([smhd])$')
+_relative_units = {'s':1, 'm':60, 'h':3600, 'd':86400}
+
+def _to_epoch(value, now=None):
+    """Resolve an epoch or a pushshift relative time (e.g. '30d') to an integer epoch."""
+    if now is None:
+        now = time.time()
+    if isinstance(value, str):
+        match = _relative_time.match(value.strip())
+        if match:
+            return int(now - int(match.group(1)) * _relative_units[match.group(2)])
+    return int(value)
+
+def _is_last_page(response, n_results):
+    """Whether a page of `n_results` holds all the results left, going by the total in its metadata."""
+    total = (response.get('metadata') or {}).get('total_results')
+    return total is not None and total <= n_results
+
+def _split_time_range(after, before, n):
+    """Split the open interval (after, before) into at most n contiguous (after, before) windows."""
+    n = max(1, min(n, before - after - 1))
+    step = (before - after) / n
+    edges = [after + int(round(step*i)) for i in range(n)] + [before]
+    # pushshift treats both bounds as exclusive, so inner windows reach one
+    # second past their upper edge to pick up items created exactly on it.
+    windows = [(edges[i], edges[i+1] + 1) for i in range(n-1)]
+    windows.append((edges[n-1], before))
+    return windows
+
+# Sentinel marking the end of a window's pages in parallel paging.
+_WINDOW_DONE = object()
+
+# Parallel paging splits the time range into this many windows per worker, so a worker that
+# finishes a sparse window moves on to the next one rather than waiting for the consumer.
+_WINDOWS_PER_WORKER = 8
+
+# Pages a parallel search may fetch ahead of the consumer, per worker.
+_PAGES_PER_WORKER = 4
+
+_fullname_prefix = re.compile(r'^t[0-9]_')
+
+def _chunked(ids, size):
+    """
+    Split `ids`, any iterable or a comma separated string of base36 ids or fullnames, into
+    lists of at most `size` base36 ids.
+    """
+    if isinstance(ids, str):
+        ids = ids.split(',')
+    ids = (_fullname_prefix.sub('', str(id).strip()) for id in ids)
+    while True:
+        chunk = list(islice(ids, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _id_payload(payload, ids):
+    return dict(payload, ids=','.join(ids), limit=len(ids))
+
+def _chunked_authors(authors, size, cache, query_key):
+    """
+    Split `authors` into lists of at most `size` that need looking up, passing through
+    ``(author, activity)`` pairs for those already in `cache`.
+    """
+    pack = []
+    for author in authors:
+        key = '{}|{}'.format(author, query_key)
+        if key in cache:
+            yield author, cache[key]
+            continue
+        pack.append(author)
+        if len(pack) == size:
+            yield pack
+            pack = []
+    if pack:
+        yield pack
+
+def _sort_by_ids(results, ids):
+    """Order `results` to match the requested `ids`."""
+    position = {id: n for n, id in enumerate(ids)}
+    results.sort(key=lambda thing: position.get(thing.get('id'), len(position)))
+    return results
+
+def _to_columns(results):
+    """Convert a list of result dicts into a dict of lists, one per field."""
+    fields = {}
+    for thing in results:
+        for k in thing:
+            fields[k] = None
+    return {k: [thing.get(k) for thing in results] for k in fields}
+
+def _to_dataframe(results):
+    try:
+        import pandas as pd
+    except ImportError:
+        raise ImportError("return_batch='dataframe' requires pandas to be installed.")
+    return pd.DataFrame.from_records(results)
+
+# Batch formats that bypass _wrap_thing, keyed by `return_batch` value.
+_batch_formats = {
+    'raw': list,
+    'columnar': _to_columns,
+    'dataframe': _to_dataframe,
+}
+
+# Record classes keyed by (kind, fields), shared by all API instances.
+_thing_types = {}
+
+def _require_fields(payload, *fields):
+    """Make sure `fields` are returned if the payload restricts them with a 'filter'."""
+    if 'filter' not in payload:
+        return
+    if not isinstance(payload['filter'], list):
+        if isinstance(payload['filter'], str):
+            payload['filter'] = [payload['filter']]
+        else:
+            payload['filter'] = list(payload['filter'])
+    for field in fields:
+        if field not in payload['filter']:
+            payload['filter'].append(field)
+
+
+class _ExactCursor(object):
+    """
+    Paging cursor on (created_utc, id) rather than created_utc alone, so items sharing the
+    boundary second of a page aren't lost. The boundary second is requested again with the
+    next page, which is enlarged to make room for items from it that were already yielded,
+    and those are then dropped.
+
+    """
+    def __init__(self, state=None):
+        self.created_utc = None
+        self.ids = set()
+        if state is not None:
+            self.created_utc = state['created_utc']
+            self.ids = set(state['ids'])
+
+    def state(self):
+        """The boundary second and the ids already yielded from it, to save in a checkpoint."""
+        return {'created_utc': self.created_utc, 'ids': sorted(self.ids)}
+
+    def request(self, payload, max_results_per_request):
+        """Payload for the next request, with the page size padded to cover already yielded items."""
+        if not self.ids:
+            return payload
+        return dict(payload, limit=min(payload['limit'] + len(self.ids), max_results_per_request))
+
+    def advance(self, payload, request, response):
+        """
+        Drop already yielded items from `response` in place and move the cursor in `payload`
+        past the ones kept. Returns True once there is nothing left to page through.
+
+        """
+        page = response.get('data', [])
+        received = len(page)
+        if self.created_utc is not None:
+            page = [thing for thing in page
+                    if thing.get('created_utc') != self.created_utc or thing.get('id') not in self.ids]
+        kept = page[:payload['limit']]
+        response['data'] = kept
+        if not kept:
+            if received < request['limit']:
+                return True
+            # More items share the boundary second than fit in a page. The rest of them
+            # can't be reached, so skip past the second.
+            warnings.warn("More than {} items share created_utc {}; some of them were skipped.".format(
+                request['limit'], self.created_utc))
+            payload['before' if payload.get('sort') == 'desc' else 'after'] = self.created_utc
+            self.created_utc = None
+            self.ids = set()
+            return False
+        if 'created_utc' not in kept[-1]:
+            return False
+        created_utc = kept[-1]['created_utc']
+        ids = set(thing.get('id') for thing in kept if thing.get('created_utc') == created_utc)
+        if created_utc == self.created_utc:
+            self.ids |= ids
+        else:
+            self.created_utc = created_utc
+            self.ids = ids
+        if payload.get('sort') == 'desc':
+            payload['before'] = created_utc + 1
+        else:
+            payload['after'] = created_utc - 1
+        return False
+
+
+class _DeferredCheckpoint(object):
+    """
+    Stands in for a checkpoint on a prefetching thread. Updates are passed to `put` to be
+    applied by the consumer once it has finished with the pages before them.
+
+    """
+    def __init__(self, checkpoint, put):
+        self.checkpoint = checkpoint
+        self.put = put
+
+    @property
+    def state(self):
+        return self.checkpoint.state
+
+    def update(self, payload, *args, **kwargs):
+        # The prefetching thread moves on with the payload before the update is applied.
+        self.put(functools.partial(self.checkpoint.update, copy.deepcopy(payload), *args, **kwargs))
+
+
+class _WindowBuffers(object):
+    """
+    Pages fetched ahead for the windows of a parallel search, shared by the threads paging the
+    windows and the consumer reading them in order. Windows ahead of the one being read wait
+    once `max_pages` pages are buffered in all, so they never hold up the one being read.
+
+    With a `limit`, a window reserves a page's worth of it before each request, and only
+    requests while it and the windows before it haven't fetched or reserved all of it.
+
+    """
+    def __init__(self, n_windows, max_pages, limit=None):
+        self.pages = [deque() for _ in range(n_windows)]
+        self.done = [False] * n_windows
+        self.fetched = [0] * n_windows
+        self.reserved = [0] * n_windows
+        self.max_pages = max_pages
+        self.limit = limit
+        self.buffered = 0
+        self.head = 0
+        self.stopped = False
+        self._cond = threading.Condition()
+
+    def budget(self, i):
+        """Items window `i` may still be needed for: the limit less those fetched by it and the windows before it."""
+        if self.limit is None:
+            return None
+        with self._cond:
+            return self.limit - sum(self.fetched[:i+1])
+
+    def reserve(self, i, size):
+        """
+        Wait until window `i` may request a page of up to `size` items. Returns False if the
+        windows before it have met the limit, or the search has stopped.
+        """
+        with self._cond:
+            while not self.stopped:
+                if self.limit is None:
+                    return True
+                fetched = sum(self.fetched[:i+1])
+                if fetched >= self.limit:
+                    return False
+                if fetched + sum(self.reserved[:i+1]) < self.limit:
+                    self.reserved[i] = size
+                    return True
+                # Earlier windows may still come up short of what they reserved.
+                self._cond.wait()
+            return False
+
+    def _full(self, i):
+        if i == self.head:
+            return len(self.pages[i]) >= self.max_pages
+        return self.buffered >= self.max_pages
+
+    def put(self, i, page):
+        """Buffer a page of window `i`, waiting for room. Returns False once the search has stopped."""
+        with self._cond:
+            while not self.stopped and self._full(i):
+                self._cond.wait()
+            if self.stopped:
+                return False
+            self.pages[i].append(page)
+            self.buffered += 1
+            self.fetched[i] += len(page.get('data', []))
+            self.reserved[i] = 0
+            self._cond.notify_all()
+            return True
+
+    def finish(self, i, error=None):
+        """Mark window `i` as done, handing the consumer `error` if paging it failed."""
+        with self._cond:
+            if error is not None:
+                self.pages[i].append(error)
+                self.buffered += 1
+            self.done[i] = True
+            self.reserved[i] = 0
+            self._cond.notify_all()
+
+    def get(self, i):
+        """The next page of window `i`, waiting for one, or `_WINDOW_DONE` once there are no more."""
+        with self._cond:
+            if self.head != i:
+                self.head = i
+                self._cond.notify_all()
+            while not self.pages[i] and not self.done[i]:
+                self._cond.wait()
+            if not self.pages[i]:
+                return _WINDOW_DONE
+            self.buffered -= 1
+            self._cond.notify_all()
+            return self.pages[i].popleft()
+
+    def stop(self):
+        with self._cond:
+            self.stopped = True
+            self._cond.notify_all()
+
+
+def _thing_to_dict(thing):
+    """A new dict of the thing's data attributes. Exposed on records as `d_`."""
+    return dict(zip(thing._fields, thing))
 
 
 class PushshiftAPIMinimal(object):
@@ -68,7 +410,17 @@ class PushshiftAPIMinimal(object):
                  utc_offset_secs=None,
                  domain='api',
                  https_proxy=None,
-                 shards_down_behavior='warn' # must be one of ['warn','stop' or None] # To do: add 'retry'
+                 shards_down_behavior='warn', # must be one of ['warn','stop' or None] # To do: add 'retry'
+                 transport=None,
+                 pool_size=10,
+                 stream_responses=False,
+                 cache=None,
+                 rate_limiter=None,
+                 adaptive_rate_limit=False,
+                 exact_paging=False,
+                 metrics=None,
+                 meta_ttl=3600,
+                 meta_cache_dir=None
                 ):
         assert max_results_per_request <= 1000
         assert backoff >= 1
@@ -86,15 +438,125 @@ class PushshiftAPIMinimal(object):
             self.proxies = {"https": https_proxy }
         else:
             self.proxies = {}
+        if transport is None:
+            transport = RequestsTransport(pool_size=pool_size, proxies=self.proxies)
+        self.transport = transport
+        self.stream_responses = stream_responses
+        self.exact_paging = exact_paging
+        self.cache = cache
         self.shards_down_behavior = shards_down_behavior
         self.metadata_ = {}
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.meta_ttl = meta_ttl
+        self.meta_cache_dir = meta_cache_dir
+
+        # Without a rate limit, the limiter is created with n=None and the server's limit
+        # is learned from /meta just before the first request (see _resolve_rate_limit).
+        if rate_limiter is None:
+            if adaptive_rate_limit:
+                rate_limiter = AdaptiveRateLimiter(n=rate_limit_per_minute, t=60)
+            else:
+                rate_limiter = RateLimitCache(n=rate_limit_per_minute, t=60)
+        self._rlcache = rate_limiter
+        self._meta_lock = threading.RLock()
+        self._meta_local = threading.local()
+
+    @property
+    def _meta_pending(self):
+        """True until the server's rate limit has been learned from /meta."""
+        return getattr(getattr(self, '_rlcache', None), 'n', 0) is None
 
-        if rate_limit_per_minute is None:
+    def _meta_cache_path(self):
+        if not self.meta_ttl:
+            return None
+        directory = self.meta_cache_dir or _default_cache_dir()
+        key = re.sub(r'[^A-Za-z0-9.]+', '_', self.base_url.format(endpoint='')).strip('_')
+        return os.path.join(directory, 'meta-{}.json'.format(key))
+
+    def _load_meta(self):
+        """Response of /meta saved by any process less than `meta_ttl` seconds ago, else None."""
+        path = self._meta_cache_path()
+        if path is None:
+            return None
+        try:
+            with open(path, encoding='utf8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - cached.get('fetched_utc', 0) > self.meta_ttl:
+            return None
+        return cached.get('meta')
+
+    def _save_meta(self, meta):
+        path = self._meta_cache_path()
+        if path is None:
+            return
+        # Written under a per-process name then renamed, so readers never see a partial file.
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf8') as f:
+                json.dump({'fetched_utc': time.time(), 'meta': meta}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.debug("Unable to cache /meta response at %s: %s" % (path, e))
+
+    def _fetch_server_rate_limit(self):
+        response = self._load_meta()
+        if response is None:
             log.debug("Connecting to /meta endpoint to learn rate limit.")
             response = self._get(self.base_url.format(endpoint='meta'))
-            rate_limit_per_minute = response['server_ratelimit_per_minute']
-            log.debug("server_ratelimit_per_minute: %s" % rate_limit_per_minute)
-        self._rlcache = RateLimitCache(n=rate_limit_per_minute, t=60)
+            self._save_meta(response)
+        rate_limit_per_minute = response['server_ratelimit_per_minute']
+        log.debug("server_ratelimit_per_minute: %s" % rate_limit_per_minute)
+        return rate_limit_per_minute
+
+    def _resolve_rate_limit(self):
+        """Set the rate limit from /meta, once for all clones sharing the rate limiter."""
+        with self._meta_lock:
+            # The /meta request itself goes through _get, which lands back here.
+            if not self._meta_pending or getattr(self._meta_local, 'resolving', False):
+                return
+            self._meta_local.resolving = True
+            try:
+                self._rlcache.n = self._fetch_server_rate_limit()
+            finally:
+                self._meta_local.resolving = False
+
+    def close(self):
+        """Release pooled connections held by the transport."""
+        self.transport.close()
+
+    def stats(self):
+        """
+        Snapshot of the metrics recorded by this instance (see :mod:`psaw.metrics`), plus
+        ``time_seconds``: total seconds spent on the network, waiting for the rate limit, backing
+        off, decoding and wrapping results. Whichever dominates is what limits the crawl.
+
+        :return: dict
+        """
+        stats = self.metrics.stats()
+        stats['time_seconds'] = {
+            'network': self.metrics.total('request_seconds'),
+            'rate_limit': self.metrics.total('rate_limit_wait_seconds_total'),
+            'backoff': self.metrics.total('backoff_seconds_total'),
+            'decode': self.metrics.total('decode_seconds_total'),
+            'wrap': self.metrics.total('wrap_seconds_total'),
+        }
+        return stats
+
+    def clone(self):
+        """
+        A copy of this instance sharing its rate limiter, transport and cache, for running
+        another search concurrently. Searches keep their paging state on the instance, so
+        concurrent searches each need their own.
+
+        :return: PushshiftAPIMinimal
+        """
+        api = copy.copy(self)
+        api.metadata_ = {}
+        api.__dict__.pop('payload', None)
+        return api
 
     @property
     def base_url(self):
@@ -124,6 +586,21 @@ class PushshiftAPIMinimal(object):
             return True
         return False
 
+    def _update_metadata(self, response):
+        self.metadata_ = response.get('metadata', {})
+        log.debug('Metadata: %s' % self.metadata_)
+        self._check_shards_down()
+
+    def _check_shards_down(self):
+        shards_down_message = "Not all PushShift shards are active. Query results may be incomplete"
+        if self.shards_are_down:
+            self.metrics.incr('shards_down_total')
+        if self.shards_are_down and (self.shards_down_behavior is not None) :
+            if self.shards_down_behavior == 'warn':
+                warnings.warn(shards_down_message)
+            if self.shards_down_behavior == 'stop':
+                raise RuntimeError(shards_down_message)
+
     def _limited(self, payload):
         """Turn off bells and whistles for special API endpoints"""
         return any(arg in payload for arg in self._limited_args)
@@ -131,154 +608,520 @@ class PushshiftAPIMinimal(object):
     def _epoch_utc_to_local(self, epoch):
         return epoch - self.utc_offset_secs
 
+    def _thing_type(self, kind, fields):
+        """Record class for a kind and field schema, built once and cached."""
+        key = (kind, fields)
+        ThingType = _thing_types.get(key)
+        if ThingType is None:
+            ThingType = type(kind, (namedtuple(kind, fields),),
+                             {'__slots__': (), 'd_': property(_thing_to_dict)})
+            _thing_types[key] = ThingType
+        return ThingType
+
     def _wrap_thing(self, thing, kind):
         """Mimic praw.Submission and praw.Comment API"""
         thing['created'] = self._epoch_utc_to_local(thing['created_utc'])
-        thing['d_'] = copy.deepcopy(thing)
-        ThingType = namedtuple(kind, thing.keys())
-        thing = ThingType(**thing)
-        return thing
-
-    def _impose_rate_limit(self, nth_request=0):
-        interval = 0
-        if  hasattr(self, '_rlcache'):
-            if self._rlcache.blocked:
-                interval = self._rlcache.interval
-        interval = max(interval, self.backoff*nth_request)
-        interval = min(interval, self.max_sleep)
+        ThingType = self._thing_type(kind, tuple(thing))
+        return ThingType._make(thing.values())
+
+    def _format_batch(self, results, return_batch, stop_condition):
+        """
+        Apply `stop_condition` to a page of raw results and convert it to one of the
+        `_batch_formats`. Returns the batch and whether the stop condition was met.
+        """
+        if return_batch not in _batch_formats:
+            raise ValueError("return_batch must be a bool or one of {}".format(sorted(_batch_formats)))
+        stopped = False
+        for i, thing in enumerate(results):
+            if stop_condition(thing):
+                results, stopped = results[:i+1], True
+                break
+        return _batch_formats[return_batch](results), stopped
+
+    def _backoff_interval(self, nth_request=0, retry_after=None):
+        """Jittered exponential backoff before the `nth_request` retry, at least `retry_after` seconds."""
+        if nth_request == 0:
+            return 0
+        interval = min(self.backoff**nth_request, self.max_sleep)
+        interval = random.uniform(interval/2, interval)
+        if retry_after is not None:
+            interval = max(interval, retry_after)
+        return min(interval, self.max_sleep)
+
+    def _impose_rate_limit(self, nth_request=0, retry_after=None):
+        interval = self._backoff_interval(nth_request, retry_after)
         if interval > 0:
-            log.debug("Imposing rate limit, sleeping for %s" % interval)
+            log.debug("Backing off, sleeping for %s" % interval)
             time.sleep(interval)
+            self.metrics.incr('backoff_seconds_total', interval)
+        if not self._meta_pending:
+            start = time.time()
+            self._rlcache.acquire()
+            self.metrics.incr('rate_limit_wait_seconds_total', time.time() - start)
+
+    def _observe(self, response, latency, stream=False):
+        """Record the outcome of a request, and report it to rate limiters that adapt to server feedback."""
+        if response is None:
+            self.metrics.incr('requests_total', code='error')
+        else:
+            self.metrics.incr('requests_total', code=response.status_code)
+            if not stream:
+                self.metrics.incr('response_bytes_total', len(response.content))
+        self.metrics.observe('request_seconds', latency)
+        observe = getattr(getattr(self, '_rlcache', None), 'observe', None)
+        if observe is None or self._meta_pending:
+            return
+        if response is None:
+            observe(None, latency, {})
+        else:
+            observe(response.status_code, latency, response.headers)
 
     def _add_nec_args(self, payload):
         """Adds 'limit' and 'created_utc' arguments to the payload as necessary."""
         if self._limited(payload):
             # Do nothing I guess? Not sure how paging works on this endpoint...
             return
-        if 'limit' not in payload:
+        if payload.get('limit') is None:
+            # limit=None means no limit, and pages are sized as when it's left out
             payload['limit'] = self.max_results_per_request
         if 'metadata' not in payload:
             payload['metadata'] = 'true'
         if 'sort' not in payload:
             # Getting weird results if this is not made explicit. Unclear why.
             payload['sort'] = 'desc'
-        if 'filter' in payload: #and payload.get('created_utc', None) is None:
-            if not isinstance(payload['filter'], list):
-                if isinstance(payload['filter'], str):
-                    payload['filter'] = [payload['filter']]
-                else:
-                    payload['filter'] = list(payload['filter'])
-            if 'created_utc' not in payload['filter']:
-                payload['filter'].append('created_utc')
+        #and payload.get('created_utc', None) is None:
+        _require_fields(payload, 'created_utc')
+        if self.exact_paging:
+            _require_fields(payload, 'id')
+
+    def _decode(self, body):
+        """Decode a response body, recording the time taken and the number of results."""
+        start = time.time()
+        response = loads(body)
+        self.metrics.incr('decode_seconds_total', time.time() - start)
+        if isinstance(response, dict) and isinstance(response.get('data'), list):
+            self.metrics.incr('items_decoded_total', len(response['data']))
+        return response
+
+    def _count_bytes(self, chunks):
+        for chunk in chunks:
+            self.metrics.incr('response_bytes_total', len(chunk))
+            yield chunk
 
-    def _get(self, url, payload={}):
+    def _cache_ttl(self, payload):
+        # '30d' names a different window every time it is sent, though the key stays the same
+        if any(isinstance(payload.get(bound), str) and _relative_time.match(payload[bound].strip())
+               for bound in ('after', 'before')):
+            return self.cache.recent_ttl
+        before = payload.get('before')
+        if before is not None:
+            try:
+                before = _to_epoch(before)
+            except ValueError:
+                before = None
+        return self.cache.ttl_for(before)
+
+    def _get(self, url, payload={}, stream=False):
         log.debug('URL: %s' % url)
         log.debug('Payload: %s' % payload)
-        i, success = 0, False
+        if self.cache is not None:
+            key = request_key(url, payload)
+            body = self.cache.get(key)
+            if body is not None:
+                self.metrics.incr('cache_hits_total')
+                return StreamedResponse([body]) if stream else self._decode(body)
+            # The full body is needed to populate the cache.
+            stream, cache_stream = False, stream
+        if self._meta_pending:
+            self._resolve_rate_limit()
+        i, success, retry_after = 0, False, None
         while (not success) and (i<self.max_retries):
             if i > 0:
                 warnings.warn("Unable to connect to pushshift.io. Retrying after backoff.")
-            self._impose_rate_limit(i)
+                self.metrics.incr('retries_total')
+            self._impose_rate_limit(i, retry_after)
             i+=1
+            response, start = None, time.time()
             try:
-                response = requests.get(url, params=payload, proxies=self.proxies)
+                response = self.transport.get(url, params=payload, stream=stream)
                 log.info(response.url)
                 log.debug('Response status code: %s' % response.status_code)
-            except requests.ConnectionError:
+            except self.transport.connection_errors:
                 log.debug("Connection error caught, retrying. Connection attempts so far: %s" % str(i+1))
                 continue
+            finally:
+                self._observe(response, time.time() - start, stream=stream)
             success = response.status_code == 200
             if not success:
                 warnings.warn("Got non 200 code %s" % response.status_code)
+                if not is_retryable(response.status_code):
+                    raise Exception("Request to pushshift.io failed with non-retryable code %s." % response.status_code)
+                retry_after = parse_retry_after(response.headers)
         if not success:
             raise Exception("Unable to connect to pushshift.io. Max retries exceeded.")
-        return json.loads(response.text)
+        if stream:
+            return StreamedResponse(self._count_bytes(response.iter_content(chunk_size=2**16)))
+        if self.cache is not None:
+            self.cache.set(key, response.content, ttl=self._cache_ttl(payload))
+            if cache_stream:
+                return StreamedResponse([response.content])
+        return self._decode(response.content)
+
+    def _advance_cursor(self, payload, last):
+        """Move the paging cursor in `payload` past `last`, the final item of a page."""
+        if last is None or 'created_utc' not in last:
+            return
+        if payload.get('sort') == 'desc':
+            payload['before'] = last['created_utc']
+        else:
+            payload['after'] = last['created_utc']
 
-    def _handle_paging(self, url):
-        limit = self.payload.get('limit', None)
+    def _handle_paging(self, url, payload=None, stream=False, checkpoint=None):
+        if payload is None:
+            payload = self.payload
+        limit = payload.get('limit', None)
+        exact = None
+        if self.exact_paging and not self._limited(payload):
+            # A resumed search picks up the boundary second where the checkpoint left it.
+            exact = _ExactCursor(checkpoint.state.get('cursor') if checkpoint is not None else None)
         #n = 0
         while True:
             if limit is not None:
                 if limit > self.max_results_per_request:
-                    self.payload['limit'] = self.max_results_per_request
+                    payload['limit'] = self.max_results_per_request
                     limit -= self.max_results_per_request
                 else:
-                    self.payload['limit'] = limit
+                    payload['limit'] = limit
                     limit = 0
-            elif 'ids' in self.payload:
-                limit = 0
-                if len(self.payload['ids']) > self.max_results_per_request:
-                    err_msg = "When searching by ID, number of IDs must be fewer than the max number of objects in a single request ({})."
-                    raise NotImplementedError(err_msg.format(self.max_results_per_request))
-            self._add_nec_args(self.payload)
-
-            data = self._get(url, self.payload)
-            yield data
-            if limit is not None:
-                received_size = int(data['metadata']['size'])
-                requested_size = self.payload['limit']
+            self._add_nec_args(payload)
+
+            if exact is None:
+                data = self._get(url, payload, stream=stream)
+            else:
+                request = exact.request(payload, self.max_results_per_request)
+                data = self._get(url, request)
+                received = len(data.get('data', []))
+                exhausted = exact.advance(payload, request, data) or _is_last_page(data, received)
+            if exact is None or exhausted or data['data']:
+                yield data
+            if exact is None:
+                # Streamed pages are only fully decoded once the consumer has drained them.
+                n_results, last = page_tail(data.get('data', []))
+                self._advance_cursor(payload, last)
+                # Saves asking for an empty page to find the end, once per window when parallel.
+                exhausted = n_results == 0 or _is_last_page(data, n_results)
+            else:
+                n_results = len(data['data'])
+            if not exhausted and limit is not None:
+                received_size = n_results if exact is not None else int(data['metadata']['size'])
+                requested_size = payload['limit']
                 # The API can decide to send less data than desired.
                 # We need to send another request in that case requesting the missing amount
                 if received_size < requested_size:
                     limit += requested_size - received_size
 
-                if limit == 0:
+            done = exhausted or limit == 0
+            if checkpoint is not None:
+                checkpoint.update(payload, limit, n_results, complete=done,
+                                  cursor=exact.state() if exact is not None else None)
+            if done:
+                return
+
+    def _handle_prefetched_paging(self, url, prefetch, checkpoint=None):
+        """
+        Page on a background thread, which moves the cursor on as soon as each page arrives
+        and keeps up to `prefetch` pages ready ahead of the consumer.
+        """
+        stop = threading.Event()
+        # Checkpoint updates travel through the queue alongside the pages they follow.
+        q = queue.Queue(maxsize=prefetch if checkpoint is None else 2*prefetch)
+        if checkpoint is not None:
+            checkpoint = _DeferredCheckpoint(checkpoint, lambda update: self._put_until_stopped(q, update, stop))
+        pages = self._handle_paging(url, checkpoint=checkpoint)
+        producer = threading.Thread(target=self._feed_queue, args=(pages, q, stop), daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = q.get()
+                if item is _WINDOW_DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                if isinstance(item, functools.partial):
+                    item()
+                    continue
+                yield item
+        finally:
+            stop.set()
+
+    def _resume_from(self, state):
+        """Restore paging state saved by a :class:`psaw.checkpoint.Checkpoint`. Returns True if the saved search already finished."""
+        if state is None or state['payload'] is None:
+            return False
+        if state['complete']:
+            log.info("Checkpointed search is already complete.")
+            return True
+        self.payload = copy.deepcopy(state['payload'])
+        # payload['limit'] holds the last page size; the remaining total is tracked separately.
+        self.payload.pop('limit', None)
+        if state['limit'] is not None:
+            self.payload['limit'] = state['limit']
+        return False
+
+    def _can_parallelize(self, payload):
+        """Time-slicing only preserves order for plain created_utc-sorted searches with a lower bound."""
+        if self._limited(payload) or payload.get('after') is None:
+            return False
+        return payload.get('sort_type', 'created_utc') == 'created_utc'
+
+    def _put_until_stopped(self, q, item, stop):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _feed_queue(self, items, q, stop):
+        """Hand `items` to a consumer via `q`, followed by any exception raised and then `_WINDOW_DONE`."""
+        try:
+            for item in items:
+                if stop.is_set() or not self._put_until_stopped(q, item, stop):
+                    return
+        except Exception as e:
+            self._put_until_stopped(q, e, stop)
+        finally:
+            self._put_until_stopped(q, _WINDOW_DONE, stop)
+
+    def _fetch_window(self, url, payload, i, buffers):
+        """Page through window `i`, buffering raw responses for the consumer until the query's limit is met."""
+        error = None
+        try:
+            budget = buffers.budget(i)
+            if budget is not None:
+                payload['limit'] = budget
+            pages = self._handle_paging(url, payload)
+            while buffers.reserve(i, self.max_results_per_request):
+                response = next(pages, None)
+                if response is None or not buffers.put(i, response):
                     return
+        except Exception as e:
+            error = e
+        finally:
+            buffers.finish(i, error)
+
+    def _handle_parallel_paging(self, url, workers, windows=None):
+        """
+        Split the query's time range into windows that are paged concurrently by a pool of
+        `workers` threads sharing this instance's rate limit. Responses are yielded window by
+        window in the query's sort order, and the query's `limit` is applied across all windows.
+
+        There are several windows per worker, taken in order, and up to a few pages per worker
+        are fetched ahead of the consumer across all of them. Each window only asks for as many
+        items as the limit leaves after the windows before it (see :class:`_WindowBuffers`).
+        """
+        remaining = self.payload.get('limit', None)
+        max_pages = workers * _PAGES_PER_WORKER
+        if remaining is not None:
+            # Fetching ahead of a limit only risks fetching past it.
+            pages = -(-remaining // self.max_results_per_request)
+            workers = max(1, min(workers, pages))
+            max_pages = max(1, min(max_pages, pages))
+        if windows is None:
+            now = time.time()
+            after = _to_epoch(self.payload['after'], now)
+            before = _to_epoch(self.payload.get('before', int(now)), now)
+            windows = _split_time_range(after, before, workers * _WINDOWS_PER_WORKER)
+        else:
+            windows = [window for after, before in windows
+                       for window in _split_time_range(after, before, _WINDOWS_PER_WORKER)]
+        if self.payload.get('sort', 'desc') == 'desc':
+            windows = sorted(windows, reverse=True)
+        else:
+            windows = sorted(windows)
+
+        buffers = _WindowBuffers(len(windows), max_pages, limit=remaining)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            for i, (w_after, w_before) in enumerate(windows):
+                payload = copy.deepcopy(self.payload)
+                payload['after'], payload['before'] = w_after, w_before
+                executor.submit(self._fetch_window, url, payload, i, buffers)
+            for i in range(len(windows)):
+                while True:
+                    response = buffers.get(i)
+                    if response is _WINDOW_DONE:
+                        break
+                    if isinstance(response, Exception):
+                        raise response
+                    if not response.get('data'):
+                        continue
+                    if remaining is not None:
+                        # Copy rather than trim in place: the worker reads the
+                        # page's last item to advance its cursor.
+                        response = dict(response, data=response['data'][:remaining])
+                        remaining -= len(response['data'])
+                    yield response
+                    if remaining == 0:
+                        return
+        finally:
+            buffers.stop()
+            executor.shutdown(wait=False)
+
+    def _fetch_ids(self, url, payload, ids, ordered):
+        response = self._get(url, _id_payload(payload, ids))
+        if ordered:
+            _sort_by_ids(response['data'], ids)
+        return response
+
+    def _handle_id_lookup(self, url, workers=None, ordered=False):
+        """
+        Look up `ids` from the query in request-sized chunks, fetched concurrently by a pool of
+        `workers` threads sharing this instance's rate limit. If `ordered`, responses follow the
+        order of the ids, otherwise they are yielded as soon as they arrive.
+        """
+        chunks = _chunked(self.payload['ids'], self.max_results_per_request)
+        payload = dict(self.payload)
+        if workers is None or workers < 2:
+            for chunk in chunks:
+                yield self._fetch_ids(url, payload, chunk, ordered)
+            return
+
+        # Only read ahead a few chunks, so ids can come from a generator of any length.
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            for chunk in chunks:
+                pending.append(executor.submit(self._fetch_ids, url, payload, chunk, ordered))
+                if len(pending) >= 2 * workers:
+                    yield self._next_completed(pending, ordered)
+            while pending:
+                yield self._next_completed(pending, ordered)
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def _next_completed(pending, ordered):
+        if ordered:
+            future = pending.popleft()
+        else:
+            future = next(iter(wait(pending, return_when=FIRST_COMPLETED).done))
+            pending.remove(future)
+        return future.result()
 
     def _search(self,
                 kind,
                 stop_condition=lambda x: False,
                 return_batch=False,
                 dataset='reddit',
+                workers=None,
+                checkpoint=None,
+                dedupe=None,
+                ordered=False,
+                prefetch=None,
+                plan=None,
                 **kwargs):
         self.metadata_ = {}
+        # ids may be a generator, which can't be copied.
+        ids = kwargs.pop('ids', None)
         self.payload = copy.deepcopy(kwargs)
+        if ids is not None:
+            self.payload['ids'] = ids
+        if plan is not None:
+            self.payload.setdefault('after', plan.after)
+            self.payload.setdefault('before', plan.before)
+        if dedupe is not None:
+            _require_fields(self.payload, 'id')
         endpoint = '{dataset}/{kind}/search'.format(dataset=dataset, kind=kind)
         url = self.base_url.format(endpoint=endpoint)
-        for response in self._handle_paging(url):
+        if checkpoint is not None:
+            if workers is not None and workers > 1:
+                raise NotImplementedError("Checkpointing is not supported for parallel searches.")
+            if self._limited(self.payload):
+                checkpoint = None
+            elif self._resume_from(checkpoint.start(kind, dataset, kwargs)):
+                return
+        if ids is not None:
+            responses = self._handle_id_lookup(url, workers, ordered)
+        elif workers is not None and workers > 1 and self._can_parallelize(self.payload):
+            windows = plan.windows if plan is not None else None
+            responses = self._handle_parallel_paging(url, workers, windows=windows)
+        else:
+            if workers is not None and workers > 1:
+                log.debug("Query can't be split into time windows, paging serially.")
+            if prefetch and not self._limited(self.payload):
+                responses = self._handle_prefetched_paging(url, prefetch, checkpoint=checkpoint)
+            else:
+                stream = self.stream_responses and not self.exact_paging and not self._limited(self.payload)
+                responses = self._handle_paging(url, stream=stream, checkpoint=checkpoint)
+        for response in responses:
             if 'aggs' in response:
                 yield response['aggs']
                 # Aggs responses are unreliable in subsequent batches with
                 # current search paging implementation. Enforce aggs result
                 # is only returned once.
-                self.payload.pop('aggs')
-            self.metadata_ = response.get('metadata', {})
-            log.debug('Metadata: %s' % self.metadata_)
+                self.payload.pop('aggs', None)
             results = response['data']
-            
-            shards_down_message = "Not all PushShift shards are active. Query results may be incomplete"
-            if self.shards_are_down and (self.shards_down_behavior is not None) :
-                if self.shards_down_behavior == 'warn':
-                    warnings.warn(shards_down_message)
-                if self.shards_down_behavior == 'stop':
-                    raise RuntimeError(shards_down_message)
-            
-            if len(results) == 0:
-                return
+            if isinstance(results, StreamedItems) and isinstance(return_batch, str):
+                results = list(results)
+                self.metrics.incr('items_decoded_total', len(results))
+            streamed = isinstance(results, StreamedItems)
+            if not streamed:
+                self._update_metadata(response)
+                if len(results) == 0:
+                    # An empty chunk of ids (e.g. all deleted) doesn't mean the later chunks are empty too.
+                    if ids is not None:
+                        continue
+                    return
+                if dedupe is not None:
+                    results = [thing for thing in results if dedupe.add(thing['id'])]
+                    if not results:
+                        continue
+            elif dedupe is not None:
+                results.filter(lambda thing: dedupe.add(thing['id']))
+
+            if isinstance(return_batch, str):
+                start = time.time()
+                batch, stopped = self._format_batch(results, return_batch, stop_condition)
+                self.metrics.incr('wrap_seconds_total', time.time() - start)
+                yield batch
+                if stopped:
+                    return
+                continue
             if return_batch:
                 batch = []
 
-            for thing in results:
-                thing = self._wrap_thing(thing, kind)
-
-                if return_batch:
-                    batch.append(thing)
-                else:
-                    yield thing
+            wrap_seconds = 0
+            try:
+                for thing in results:
+                    start = time.time()
+                    thing = self._wrap_thing(thing, kind)
+                    wrap_seconds += time.time() - start
 
-                if stop_condition(thing):
                     if return_batch:
-                        return batch
-                    return
+                        batch.append(thing)
+                    else:
+                        yield thing
+
+                    if stop_condition(thing):
+                        if return_batch:
+                            return batch
+                        return
+            finally:
+                self.metrics.incr('wrap_seconds_total', wrap_seconds)
 
             if return_batch:
                 yield batch
 
-            # For paging.
-            if self.payload.get('sort') == 'desc':
-                self.payload['before'] = thing.created_utc
-            else:
-                self.payload['after'] = thing.created_utc
+            if streamed:
+                # Metadata follows the data in the response body.
+                self.metrics.incr('items_decoded_total', results.count)
+                self._update_metadata(response)
+                if results.count == 0:
+                    return
 
 
 #class PushshiftAPI(PushshiftAPIMinimal):
@@ -286,23 +1129,26 @@ class PushshiftAPIMinimal(object):
 #    pass
 
 class PushshiftAPI(PushshiftAPIMinimal):
-    def __init__(self, r=None, *args, **kwargs):
+    def __init__(self, r=None, *args, pipeline_depth=0, **kwargs):
         """
         Helper class for interacting with the PushShift API for searching public reddit archival data.
-        
-        :param r: :class:`praw.Reddit` instance. If provided, PushShift will be used to fetch thing IDs, then data will be fetched directly from the reddit API via praw.
-        :type r: class:`praw.Reddit`, optional
-        
+
+        :param r: :class:`praw.Reddit` instance. If provided, PushShift will be used to fetch thing IDs, then data will be fetched directly from the reddit API via praw. A list of instances (e.g. logged in with different credentials) spreads the praw requests across all of them, each in its own thread.
+        :type r: class:`praw.Reddit` or list, optional
+
+        :param pipeline_depth: Number of pages of IDs to fetch from PushShift in the background while praw fetches the data for earlier pages, defaults to 0 (fetch in turns). At least 1 when `r` is a list.
+        :type pipeline_depth: int, optional
+
         :param max_retries: Maximum number of retries to attempt before quitting, defaults to 20.
         :type max_retries: int, optional
         
         :param max_sleep: Threshold waiting time (in seconds) between requests, to limit exponential backoff behavior, defaults to 3600 (1 hour).
         :type max_sleep: int, optional
         
-        :param backoff: Multiplier for exponential backoff of wait time between failed requests, defaults to 2.
+        :param backoff: Base for exponential backoff of wait time between failed requests, defaults to 2. The wait before the nth retry is drawn uniformly from [backoff**n / 2, backoff**n].
         :type backoff: int or float, optional
         
-        :param rate_limit_per_minute: Maximum number of requests per 60 second period. If not provided, inferred from PushShift /meta endpoint.
+        :param rate_limit_per_minute: Maximum number of requests per 60 second period. If not provided, inferred from PushShift /meta endpoint on the first request.
         :type rate_limit_per_minute: int, optional
         
         :param max_results_per_request: Maximum number of items to return in a single request, defaults to 1000.
@@ -322,9 +1168,44 @@ class PushshiftAPI(PushshiftAPIMinimal):
         
         :param shards_down_behavior: How PSAW should behave if PushShift reports that some shards were down during a query. Options are "warn" to only emit a warning, "stop" to throw a RuntimeError, or None to take no action. Defaults to "warn".
         :type shards_down_behavior: str, optional
+        
+        :param transport: Object used to issue HTTP GET requests, e.g. a :class:`psaw.transport.ReplayTransport` for tests. Defaults to a pooled keep-alive :class:`psaw.transport.RequestsTransport` (in which case `https_proxy` is applied to it).
+        :type transport: :class:`psaw.transport.Transport`, optional
+        
+        :param pool_size: Number of keep-alive connections held by the default transport, defaults to 10. Should be at least the number of `workers` used for parallel searches.
+        :type pool_size: int, optional
+        
+        :param stream_responses: Decode each page incrementally, yielding results as they arrive rather than after the whole page is downloaded and parsed, defaults to False. Not used for `aggs`/`ids` queries or parallel searches.
+        :type stream_responses: boolean, optional
+        
+        :param cache: On-disk cache consulted before each request and populated with each successful response, defaults to None (no caching).
+        :type cache: :class:`psaw.cache.ResponseCache`, optional
+        
+        :param adaptive_rate_limit: Adjust request rate and concurrency to server feedback (throttling, errors, latency and Retry-After headers) with a :class:`psaw.adaptive.AdaptiveRateLimiter`, rather than always pacing at `rate_limit_per_minute`, defaults to False.
+        :type adaptive_rate_limit: boolean, optional
+        
+        :param rate_limiter: Rate limiter to use instead of a private per-instance one, e.g. to share one budget between processes. Anything with `acquire` and `try_acquire` methods like those of :class:`RateLimitCache` will do. If provided, `rate_limit_per_minute` is ignored.
+        :type rate_limiter: :class:`psaw.ratelimit.FileRateLimiter` or :class:`psaw.ratelimit.SocketRateLimiter`, optional
+        
+        :param exact_paging: Page on (created_utc, id) instead of created_utc alone, so items posted in the same second as the last item of a page aren't skipped, defaults to False. Disables `stream_responses`.
+        :type exact_paging: boolean, optional
+
+        :param metrics: Where to record request counts and timings, e.g. one shared by several clients, defaults to a new instance. Available as `metrics` and summarized by :meth:`stats`.
+        :type metrics: :class:`psaw.metrics.Metrics`, optional
+
+        :param meta_ttl: Seconds for which the response of the /meta endpoint, fetched on the first request when `rate_limit_per_minute` isn't provided, is reused by later instances and other processes, defaults to 3600. 0 or None to fetch it every time.
+        :type meta_ttl: int, optional
+
+        :param meta_cache_dir: Directory the /meta response is cached in, defaults to ``$XDG_CACHE_HOME/psaw`` (``~/.cache/psaw``).
+        :type meta_cache_dir: str, optional
         """
         super().__init__(*args, **kwargs)
         self.r = r
+        self._reddits = list(r) if isinstance(r, (list, tuple)) else [r]
+        if len(self._reddits) > 1:
+            pipeline_depth = max(pipeline_depth, 1)
+        self.pipeline_depth = pipeline_depth
+        self._activity_cache = {}
         self._search_func = self._search
         if r is not None:
             self._search_func = self._praw_search
@@ -335,6 +1216,55 @@ class PushshiftAPI(PushshiftAPIMinimal):
     def search_submissions(self, **kwargs):
         return self._search_func(kind='submission', **kwargs)
 
+    def plan_search(self, kind='comment', windows=8, frequency='day', dataset='reddit', **kwargs):
+        """
+        Estimate the size of a search from a histogram of when its results were created, and
+        split it into `windows` time windows expected to hold about the same number of results.
+        Takes a single aggregation request.
+
+        :param kind: 'comment' or 'submission', defaults to 'comment'.
+        :type kind: str, optional
+
+        :param windows: Number of windows to plan, defaults to 8.
+        :type windows: int, optional
+
+        :param frequency: Histogram bucket size: 'second', 'minute', 'hour', 'day', 'week', 'month' or 'year', defaults to 'day'. Finer buckets balance windows better at short time scales.
+        :type frequency: str, optional
+
+        Remaining keyword arguments are the search arguments.
+
+        :return: :class:`psaw.planner.CrawlPlan`
+        """
+        kwargs.pop('limit', None)
+        now = time.time()
+        after = kwargs.get('after')
+        before = _to_epoch(kwargs.get('before', int(now)), now)
+        agg = next(self._search(kind=kind, dataset=dataset, aggs='created_utc',
+                                frequency=frequency, size=0, **kwargs))
+        buckets = histogram_buckets(agg['created_utc'], frequency,
+                                    after=None if after is None else _to_epoch(after, now),
+                                    before=before)
+        if after is None:
+            after = buckets[0][0] - 1 if buckets else before - 1
+        else:
+            after = _to_epoch(after, now)
+        return CrawlPlan(buckets, after, before, windows,
+                         page_size=self.max_results_per_request,
+                         rate_limit_per_minute=getattr(self._rlcache, 'n', None))
+
+    def resume_search(self, checkpoint, **kwargs):
+        """
+        Continue the search recorded in a checkpoint, without having to repeat its arguments.
+
+        :param checkpoint: Checkpoint of a previous search
+        :type checkpoint: :class:`psaw.checkpoint.Checkpoint`
+        """
+        state = checkpoint.load()
+        if state is None:
+            raise ValueError("No checkpointed search found at {}".format(checkpoint.path))
+        query = dict(state['query'], **kwargs)
+        return self._search_func(kind=state['kind'], dataset=state['dataset'], checkpoint=checkpoint, **query)
+
     def redditor_subreddit_activity(self, author, **kwargs):
         """
         :param author: Redditor to be profiled
@@ -346,6 +1276,92 @@ class PushshiftAPI(PushshiftAPIMinimal):
             outv[k] = Counter({rec['key']:rec['doc_count'] for rec in agg['subreddit']})
         return outv
 
+    def redditors_subreddit_activity(self, authors, workers=4, pack_size=10, cache=None, **kwargs):
+        """
+        Profile many redditors at once, yielding ``(author, activity)`` pairs as each profile is
+        completed, where `activity` is the same as returned by :meth:`redditor_subreddit_activity`.
+
+        Up to `pack_size` authors are looked up per request by fetching just the subreddit of
+        each of their things and counting them locally. Packs with more things than fit in one
+        page are split, down to a single author, whose counts are then aggregated by PushShift.
+        Packs are fetched concurrently by `workers` threads sharing this instance's rate limit.
+
+        :param authors: Redditors to be profiled
+        :type authors: iterable of str
+
+        :param workers: Number of packs to look up concurrently, defaults to 4.
+        :type workers: int, optional
+
+        :param pack_size: Maximum number of authors per request, defaults to 10.
+        :type pack_size: int, optional
+
+        :param cache: Mapping in which profiles are stored and looked up by author and search arguments, e.g. a :mod:`shelve` to keep them between sessions. Defaults to a dict kept by this instance.
+        :type cache: dict-like, optional
+        """
+        if cache is None:
+            cache = self._activity_cache
+        query_key = repr(sorted(kwargs.items()))
+        # Only read ahead a few packs, so authors can come from a generator of any length.
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            for pack in _chunked_authors(authors, pack_size, cache, query_key):
+                if isinstance(pack, tuple):
+                    yield pack
+                    continue
+                pending.append(executor.submit(self._pack_subreddit_activity, pack, **kwargs))
+                if len(pending) >= 2 * workers:
+                    yield from self._store_activity(self._next_completed(pending, False), cache, query_key)
+            while pending:
+                yield from self._store_activity(self._next_completed(pending, False), cache, query_key)
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def _store_activity(activity, cache, query_key):
+        for author, profile in activity.items():
+            cache['{}|{}'.format(author, query_key)] = profile
+            yield author, profile
+
+    def _pack_subreddit_activity(self, authors, **kwargs):
+        counts = {k: self._subreddit_counts(k, authors, **kwargs) for k in ('comment', 'submission')}
+        return {author: {k: counts[k][author] for k in counts} for author in authors}
+
+    def _subreddit_counts(self, kind, authors, **kwargs):
+        """Subreddit Counter per author of things of `kind`"""
+        url = self.base_url.format(endpoint='reddit/{}/search'.format(kind))
+        if len(authors) == 1:
+            response = self._get(url, dict(kwargs, author=authors[0], aggs='subreddit'))
+            agg = response['aggs']['subreddit']
+            return {authors[0]: Counter({rec['key']:rec['doc_count'] for rec in agg})}
+
+        payload = dict(kwargs, author=','.join(authors), filter=['author', 'subreddit'],
+                       limit=self.max_results_per_request, metadata='true')
+        response = self._get(url, payload)
+        data = response['data']
+        # The server may cap a page below `limit`, so only the reported total tells whether
+        # this page holds everything the pack wrote.
+        total = response.get('metadata', {}).get('total_results')
+        if total is None:
+            # no metadata: a full page is all there is to go on
+            total = len(data) + (len(data) >= self.max_results_per_request)
+        if total > len(data):
+            # Incomplete: split the pack rather than page through it.
+            half = len(authors) // 2
+            counts = self._subreddit_counts(kind, authors[:half], **kwargs)
+            counts.update(self._subreddit_counts(kind, authors[half:], **kwargs))
+            return counts
+        # PushShift matches authors case-insensitively.
+        counts = {author: Counter() for author in authors}
+        by_name = {author.lower(): counts[author] for author in authors}
+        for thing in data:
+            counter = by_name.get(thing.get('author', '').lower())
+            if counter is not None:
+                counter[thing['subreddit']] += 1
+        return counts
+
     def _get_submission_comment_ids(self, submission_id, **kwargs):
         self.payload = copy.deepcopy(kwargs)
         endpoint = 'reddit/submission/comment_ids/{}'.format(submission_id)
@@ -354,33 +1370,87 @@ class PushshiftAPI(PushshiftAPIMinimal):
 
     def _praw_search(self, **kwargs):
         prefix = self._thing_prefix[kwargs['kind'].title()]
+        checkpoint = kwargs.pop('checkpoint', None)
+        dedupe = kwargs.pop('dedupe', None)
+        ids = kwargs.pop('ids', None)
 
         self.payload = copy.deepcopy(kwargs)
+        if ids is not None:
+            self.payload['ids'] = ids
 
-        client_return_batch = kwargs.get('return_batch')
-        if client_return_batch is False:
-            self.payload.pop('return_batch')
+        client_return_batch = self.payload.pop('return_batch', False)
 
         if 'filter' in kwargs:
             self.payload.pop('filter')
 
 
-        gen = self._search(return_batch=True, filter='id', **self.payload)
+        gen = self._search(return_batch=True, filter='id', checkpoint=checkpoint, dedupe=dedupe, **self.payload)
         using_gsci = False
         if kwargs.get('kind') == 'comment' and self.payload.get('submission_id'):
             using_gsci = True
             gen = [self._get_submission_comment_ids(**kwargs)]
 
-        for batch in gen:
-            if not batch:
-                return
-            if using_gsci:
-                fullnames = [prefix + base36id for base36id in batch]
-            else:
-                fullnames = [prefix + c.id for c in batch]
-            praw_batch = self.r.info(fullnames=fullnames)
+        if self.pipeline_depth > 0:
+            praw_batches = self._hydrate_pipelined(gen, prefix, using_gsci)
+        else:
+            praw_batches = self._hydrate(gen, prefix, using_gsci)
+        for praw_batch in praw_batches:
             if client_return_batch:
                 yield praw_batch
             else:
                 for praw_thing in praw_batch:
                     yield praw_thing
+
+    @staticmethod
+    def _fullnames(batch, prefix, using_gsci):
+        if using_gsci:
+            return [prefix + base36id for base36id in batch]
+        return [prefix + c.id for c in batch]
+
+    def _hydrate(self, batches, prefix, using_gsci):
+        for batch in batches:
+            if not batch:
+                return
+            yield self._reddits[0].info(fullnames=self._fullnames(batch, prefix, using_gsci))
+
+    def _hydrate_batch(self, reddit, batch, prefix, using_gsci):
+        return list(reddit.info(fullnames=self._fullnames(batch, prefix, using_gsci)))
+
+    def _hydrate_pipelined(self, batches, prefix, using_gsci):
+        """
+        Fetch ID batches from PushShift in a background thread, up to `pipeline_depth` batches ahead,
+        while earlier batches are fetched from reddit. Each praw instance works in its own thread,
+        taking batches in turn, and results are yielded in the order PushShift returned them.
+        """
+        stop = threading.Event()
+        id_queue = queue.Queue(maxsize=self.pipeline_depth)
+        producer = threading.Thread(target=self._feed_queue, args=(batches, id_queue, stop), daemon=True)
+        # praw instances aren't thread safe, so each gets a single thread of its own.
+        hydrators = [ThreadPoolExecutor(max_workers=1) for _ in self._reddits]
+        pending = deque()
+        error = None
+        producer.start()
+        try:
+            n = 0
+            while True:
+                batch = id_queue.get()
+                if isinstance(batch, Exception):
+                    error = batch
+                    break
+                if batch is _WINDOW_DONE or not batch:
+                    break
+                i = n % len(hydrators)
+                pending.append(hydrators[i].submit(self._hydrate_batch, self._reddits[i], batch, prefix, using_gsci))
+                n += 1
+                if len(pending) >= len(hydrators):
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+            if error is not None:
+                raise error
+        finally:
+            stop.set()
+            for future in pending:
+                future.cancel()
+            for hydrator in hydrators:
+                hydrator.shutdown(wait=False)
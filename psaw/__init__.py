@@ -13,4 +13,21 @@ __version__ = '0.0.12'
 import logging
 from logging import NullHandler
 
-logging.getLogger(__name__).addHandler(NullHandler())
\ No newline at end of file
+logging.getLogger(__name__).addHandler(NullHandler())
+
+
+# Imported when first asked for: AsyncPushshiftAPI pulls in asyncio, and LocalPushshiftAPI sqlite3.
+_lazy = {
+    'AsyncPushshiftAPI': 'AsyncPushshiftAPI',
+    'LocalPushshiftAPI': 'archive',
+}
+
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    import importlib
+    value = getattr(importlib.import_module('.' + _lazy[name], __name__), name)
+    # Importing a submodule binds its name here to the module, not the class.
+    globals()[name] = value
+    return value
@@ -0,0 +1,175 @@
+"""
+Adaptive request pacing driven by server feedback.
+"""
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Status codes worth retrying: timeouts, throttling and server-side failures. 403 is
+# included because pushshift's CDN uses it for temporary blocks.
+_retryable_codes = frozenset([403, 408, 425, 429])
+
+
+def is_retryable(status_code):
+    """
+    Whether a request that failed with `status_code` may succeed if retried
+
+    :param status_code: int
+    :return: bool
+    """
+    return status_code in _retryable_codes or status_code >= 500
+
+
+def parse_retry_after(headers):
+    """
+    Seconds to wait according to a Retry-After header, if present
+
+    :param headers: dict-like
+    :return: float or None
+    """
+    value = headers.get('Retry-After') if headers else None
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    # HTTP dates are rare here, and email.utils is slow to import.
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter(object):
+    """
+    Rate and concurrency controller that adjusts to server feedback AIMD-style.
+
+    Requests are paced evenly at the current rate, which starts at the server's limit of `n` per
+    `t` seconds. Each successful response adds `increase` of the limit back to the rate and
+    grows the number of requests allowed in flight. Each throttled (429), failed (5xx) or dropped
+    request multiplies both by `decrease`. Concurrency is also trimmed while latency is well above
+    the fastest seen. A Retry-After header, or an ``X-RateLimit-Remaining`` of zero with an
+    ``X-RateLimit-Reset``, pauses all requests until the server is ready again.
+
+    :param n: Server rate limit, in requests per `t` seconds.
+    :type n: int
+
+    :param t: Length of the rate limit period in seconds, defaults to 60.
+    :type t: int or float, optional
+
+    :param max_concurrency: Upper bound on requests in flight, defaults to 8.
+    :type max_concurrency: int, optional
+
+    :param increase: Fraction of the limit added to the rate per success, defaults to 0.02.
+    :type increase: float, optional
+
+    :param decrease: Factor applied to rate and concurrency on failure, defaults to 0.5.
+    :type decrease: float, optional
+
+    :param min_rate_fraction: Lowest rate, as a fraction of the limit, defaults to 0.05.
+    :type min_rate_fraction: float, optional
+
+    :param latency_threshold: Latency, as a multiple of the fastest response seen, above which concurrency is reduced, defaults to 3.
+    :type latency_threshold: float, optional
+    """
+    def __init__(self,
+                 n,
+                 t=60,
+                 max_concurrency=8,
+                 increase=0.02,
+                 decrease=0.5,
+                 min_rate_fraction=0.05,
+                 latency_threshold=3):
+        self.t = t
+        self.max_concurrency = max_concurrency
+        self.increase = increase
+        self.decrease = decrease
+        self.min_rate_fraction = min_rate_fraction
+        self.latency_threshold = latency_threshold
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self.latency = None
+        self.min_latency = None
+        self._next_slot = 0
+        self._paused_until = 0
+        self._lock = threading.Lock()
+        self.n = n
+
+    @property
+    def n(self):
+        return self._n
+
+    @n.setter
+    def n(self, n):
+        """Setting the server limit resets the rate to it."""
+        self._n = n
+        if n is not None:
+            self.max_rate = n / self.t
+            self.rate = self.max_rate
+
+    def try_acquire(self):
+        with self._lock:
+            now = time.time()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self.in_flight >= int(self.concurrency):
+                # Poll until an in-flight request completes.
+                return 0.05
+            if self._next_slot > now:
+                return self._next_slot - now
+            self._next_slot = now + 1 / self.rate
+            self.in_flight += 1
+            return 0
+
+    def acquire(self):
+        while True:
+            interval = self.try_acquire()
+            if interval == 0:
+                return
+            log.debug("Imposing rate limit, sleeping for %s" % interval)
+            time.sleep(interval)
+
+    def observe(self, status_code, latency, headers=None):
+        """
+        Record the outcome of a request granted by :meth:`acquire`
+
+        :param status_code: int, or None if the connection failed
+        :param latency: float
+            seconds from sending the request to receiving the response
+        :param headers: dict-like
+            response headers
+        """
+        headers = headers or {}
+        with self._lock:
+            now = time.time()
+            self.in_flight = max(self.in_flight - 1, 0)
+            if status_code is None or status_code == 429 or status_code >= 500:
+                self.rate = max(self.rate * self.decrease, self.max_rate * self.min_rate_fraction)
+                self.concurrency = max(self.concurrency * self.decrease, 1)
+                log.debug("Backing off to %.3f requests/s, concurrency %.1f" % (self.rate, self.concurrency))
+            elif status_code == 200:
+                self.rate = min(self.rate + self.max_rate * self.increase, self.max_rate)
+                self.concurrency = min(self.concurrency + 1 / self.concurrency, self.max_concurrency)
+                self._observe_latency(latency)
+
+            retry_after = parse_retry_after(headers)
+            if retry_after is None and headers.get('X-RateLimit-Remaining') == '0':
+                try:
+                    retry_after = float(headers.get('X-RateLimit-Reset'))
+                except (TypeError, ValueError):
+                    retry_after = None
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+    def _observe_latency(self, latency):
+        if self.latency is None:
+            self.latency = self.min_latency = latency
+            return
+        self.latency = 0.8 * self.latency + 0.2 * latency
+        self.min_latency = min(self.min_latency, latency)
+        if self.latency > self.latency_threshold * self.min_latency and self.concurrency > 1:
+            self.concurrency = max(self.concurrency * 0.9, 1)
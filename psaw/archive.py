@@ -0,0 +1,435 @@
+"""
+Local archive of comments and submissions, kept up to date from PushShift and searchable offline.
+
+:class:`Archive` stores things in a SQLite database indexed on ``author``, ``subreddit``,
+``created_utc`` and ``link_id``, with a full text index of comment bodies and submission titles
+and selftext where SQLite's FTS5 extension is available. :meth:`Archive.sync` fetches only things
+newer than those stored by earlier syncs of the same search, and :class:`LocalPushshiftAPI`
+answers searches from the archive with no network access.
+"""
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import warnings
+
+from .PushshiftAPI import PushshiftAPI, _fullname_prefix, _require_fields, _to_epoch
+from .decoding import loads
+from .planner import _frequency_secs
+from .transport import Transport
+
+log = logging.getLogger(__name__)
+
+_tables = {'comment': 'comments', 'submission': 'submissions'}
+
+# Author and subreddit are matched case-insensitively, as PushShift does.
+_schema = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id TEXT PRIMARY KEY,
+    created_utc INTEGER NOT NULL,
+    author TEXT COLLATE NOCASE,
+    subreddit TEXT COLLATE NOCASE,
+    link_id TEXT,
+    text TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS {table}_created_utc ON {table} (created_utc);
+CREATE INDEX IF NOT EXISTS {table}_author ON {table} (author, created_utc);
+CREATE INDEX IF NOT EXISTS {table}_subreddit ON {table} (subreddit, created_utc);
+CREATE INDEX IF NOT EXISTS {table}_link_id ON {table} (link_id, created_utc);
+"""
+
+# External content FTS5 index of the text column, kept in step by triggers.
+_fts_schema = """
+CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(text, content='{table}', content_rowid='rowid');
+CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+    INSERT INTO {table}_fts (rowid, text) VALUES (new.rowid, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF text ON {table} BEGIN
+    INSERT INTO {table}_fts ({table}_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+    INSERT INTO {table}_fts (rowid, text) VALUES (new.rowid, new.text);
+END;
+"""
+
+_syncs_schema = """
+CREATE TABLE IF NOT EXISTS syncs (
+    kind TEXT NOT NULL,
+    query TEXT NOT NULL,
+    high_water INTEGER,
+    items INTEGER NOT NULL DEFAULT 0,
+    synced_utc REAL,
+    PRIMARY KEY (kind, query)
+);
+"""
+
+# An upsert rather than INSERT OR REPLACE, which would delete rows without firing triggers.
+_upsert = """
+INSERT INTO {table} (id, created_utc, author, subreddit, link_id, text, data)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET
+    created_utc = excluded.created_utc, author = excluded.author, subreddit = excluded.subreddit,
+    link_id = excluded.link_id, text = excluded.text, data = excluded.data
+"""
+
+_update_sync = """
+INSERT INTO syncs (kind, query, high_water, items, synced_utc) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (kind, query) DO UPDATE SET
+    high_water = MAX(COALESCE(high_water, excluded.high_water), COALESCE(excluded.high_water, high_water)),
+    items = items + excluded.items, synced_utc = excluded.synced_utc
+"""
+
+# Search arguments answered from the archive. Any other is rejected rather than ignored.
+_local_args = {'q', 'author', 'subreddit', 'link_id', 'ids', 'after', 'before', 'sort',
+               'sort_type', 'limit', 'size', 'filter', 'metadata', 'aggs', 'frequency'}
+
+# Search arguments that don't change which things a sync fetches, only how.
+_paging_args = {'after', 'before', 'limit', 'sort', 'workers', 'prefetch', 'plan'}
+
+_phrases = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def _values(value):
+    """Values of a search argument given as a list or a comma separated string."""
+    if isinstance(value, (list, tuple, set)):
+        value = ','.join(str(v) for v in value)
+    return [v.strip() for v in str(value).split(',') if v.strip()]
+
+
+def _terms(q):
+    """Words and quoted phrases of a ``q`` search argument, all of which must match."""
+    if isinstance(q, (list, tuple)):
+        q = ' '.join(q)
+    return [a or b for a, b in _phrases.findall(q) if a or b]
+
+
+def _text(kind, thing):
+    if kind == 'comment':
+        return thing.get('body')
+    text = [thing[field] for field in ('title', 'selftext') if thing.get(field)]
+    return '\n'.join(text) if text else None
+
+
+def _sync_key(kwargs):
+    return json.dumps({k: v for k, v in kwargs.items() if k not in _paging_args},
+                      sort_keys=True, default=str)
+
+
+class Archive(object):
+    """
+    SQLite database of comments and submissions, searchable with PushShift's search arguments.
+    Safe to share between threads, and between processes using the same file.
+
+    :param path: Location of the SQLite database, defaults to 'psaw_archive.sqlite'.
+    :type path: str, optional
+
+    :param full_text: Answer ``q`` searches from a full text index, if SQLite's FTS5 extension is available, defaults to True. Otherwise they scan every thing in the time range searched.
+    :type full_text: boolean, optional
+    """
+    def __init__(self, path='psaw_archive.sqlite', full_text=True):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_syncs_schema + ''.join(_schema.format(table=table)
+                                                         for table in _tables.values()))
+        self.full_text = full_text and self._create_full_text_index()
+
+    def _create_full_text_index(self):
+        for table in _tables.values():
+            exists = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?",
+                                        (table + '_fts',)).fetchone()
+            try:
+                self._conn.executescript(_fts_schema.format(table=table))
+            except sqlite3.OperationalError as e:
+                warnings.warn("Full text index unavailable ({}), q searches will be slow.".format(e))
+                return False
+            if not exists:
+                # Index things stored before there was an index.
+                self._conn.execute("INSERT INTO {0}_fts ({0}_fts) VALUES ('rebuild')".format(table))
+        return True
+
+    @staticmethod
+    def _table(kind):
+        if kind not in _tables:
+            raise ValueError("kind must be 'comment' or 'submission', not {!r}".format(kind))
+        return _tables[kind]
+
+    def close(self):
+        self._conn.close()
+
+    def count(self, kind='comment'):
+        """
+        Number of things of `kind` stored
+
+        :param kind: str
+        :return: int
+        """
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM {}'.format(self._table(kind))).fetchone()[0]
+
+    def add(self, kind, things):
+        """
+        Store things, replacing any stored with the same id
+
+        :param kind: 'comment' or 'submission'
+        :param things: iterable of dict, or of things returned by searches
+        :return: int
+            number of things stored
+        """
+        return self._store(kind, things)
+
+    def _store(self, kind, things, sync_key=None):
+        """Store things, and if `sync_key` is given raise its high-water mark in the same transaction."""
+        table = self._table(kind)
+        rows = []
+        high_water = None
+        for thing in things:
+            if hasattr(thing, 'd_'):
+                thing = {k: v for k, v in thing.d_.items() if k != 'created'}
+            created_utc = int(thing['created_utc'])
+            if high_water is None or created_utc > high_water:
+                high_water = created_utc
+            rows.append((_fullname_prefix.sub('', thing['id']), created_utc, thing.get('author'),
+                         thing.get('subreddit'), thing.get('link_id'), _text(kind, thing),
+                         json.dumps(thing, separators=(',', ':'))))
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany(_upsert.format(table=table), rows)
+                if sync_key is not None:
+                    self._conn.execute(_update_sync, (kind, sync_key, high_water, len(rows), time.time()))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return len(rows)
+
+    def high_water(self, kind='comment', **kwargs):
+        """
+        ``created_utc`` of the newest thing stored by syncs of a search, or None if it hasn't been synced
+
+        :param kind: str
+        :param kwargs: search arguments, as passed to :meth:`sync`
+        :return: int
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT high_water FROM syncs WHERE kind = ? AND query = ?',
+                                     (kind, _sync_key(kwargs))).fetchone()
+        return None if row is None else row[0]
+
+    def sync(self, api, kind='comment', **kwargs):
+        """
+        Store the things matching a search that are newer than those stored by earlier syncs of
+        the same search, as identified by its arguments other than `after`, `before` and `limit`.
+        Things are fetched oldest first, and the high-water mark is saved with each page, so an
+        interrupted sync continues from where it stopped.
+
+        :param api: Client to search with, e.g. a :class:`psaw.PushshiftAPI`.
+        :type api: :class:`psaw.PushshiftAPI`
+
+        :param kind: 'comment' or 'submission', defaults to 'comment'.
+        :type kind: str, optional
+
+        Remaining keyword arguments are the search arguments. `after` only applies to the
+        first sync of a search.
+
+        :return: int
+            number of things stored
+        """
+        self._table(kind)
+        key = _sync_key(kwargs)
+        high_water = self.high_water(kind, **kwargs)
+        kwargs = dict(kwargs, sort='asc')
+        if high_water is not None:
+            # The high-water second is fetched again, in case more was created in it since.
+            kwargs['after'] = high_water - 1
+        _require_fields(kwargs, 'id')
+        log.info("Syncing %ss of %s after %s" % (kind, key, kwargs.get('after')))
+        n = 0
+        search = api.search_comments if kind == 'comment' else api.search_submissions
+        for page in search(return_batch='raw', **kwargs):
+            if page:
+                n += self._store(kind, page, sync_key=key)
+        if n == 0:
+            # Record the sync, so that the search is listed even if nothing was found.
+            with self._lock:
+                self._conn.execute(_update_sync, (kind, key, None, 0, time.time()))
+        return n
+
+    def syncs(self):
+        """
+        Searches synced into the archive, with their high-water marks
+
+        :return: list of dict
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT kind, query, high_water, items, synced_utc FROM syncs '
+                                      'ORDER BY kind, query').fetchall()
+        return [dict(kind=kind, query=json.loads(query), high_water=high_water, items=items,
+                     synced_utc=synced_utc) for kind, query, high_water, items, synced_utc in rows]
+
+    def _where(self, kind, payload):
+        """WHERE clause and parameters selecting the things matching search arguments."""
+        unsupported = set(payload) - _local_args
+        if unsupported:
+            raise NotImplementedError("Archives can't be searched by {}.".format(', '.join(sorted(unsupported))))
+        table = self._table(kind)
+        clauses, params = [], []
+
+        def match(column, values):
+            clauses.append('{} IN ({})'.format(column, ','.join('?' * len(values))))
+            params.extend(values)
+
+        for field in ('author', 'subreddit'):
+            if payload.get(field) is not None:
+                match(field, _values(payload[field]))
+        if payload.get('link_id') is not None:
+            match('link_id', ['t3_' + _fullname_prefix.sub('', v) for v in _values(payload['link_id'])])
+        if payload.get('ids') is not None:
+            match('id', [_fullname_prefix.sub('', v) for v in _values(payload['ids'])])
+        now = time.time()
+        if payload.get('after') is not None:
+            clauses.append('created_utc > ?')
+            params.append(_to_epoch(payload['after'], now))
+        if payload.get('before') is not None:
+            clauses.append('created_utc < ?')
+            params.append(_to_epoch(payload['before'], now))
+        terms = _terms(payload['q']) if payload.get('q') else []
+        if terms and self.full_text:
+            # Every term is quoted, so that it's matched as a phrase rather than parsed as FTS5 syntax.
+            clauses.append('rowid IN (SELECT rowid FROM {0}_fts WHERE {0}_fts MATCH ?)'.format(table))
+            params.append(' '.join('"{}"'.format(term.replace('"', '""')) for term in terms))
+        else:
+            for term in terms:
+                clauses.append('text LIKE ?')
+                params.append('%{}%'.format(term))
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def search(self, kind, payload):
+        """
+        Things matching PushShift search arguments, e.g. ``{'subreddit': 'askscience',
+        'after': '30d', 'limit': 100}``
+
+        :param kind: 'comment' or 'submission'
+        :param payload: dict
+        :return: list of dict
+        """
+        payload = {k: v for k, v in payload.items() if k not in ('aggs', 'frequency')}
+        sort = payload.get('sort', 'desc')
+        if sort not in ('asc', 'desc'):
+            raise ValueError("sort must be 'asc' or 'desc', not {!r}".format(sort))
+        if payload.get('sort_type', 'created_utc') != 'created_utc':
+            raise NotImplementedError("Archives can only be sorted by created_utc.")
+        limit = int(payload.get('limit', payload.get('size', 25)))
+        where, params = self._where(kind, payload)
+        sql = 'SELECT data FROM {}{} ORDER BY created_utc {} LIMIT ?'.format(self._table(kind), where, sort)
+        with self._lock:
+            rows = self._conn.execute(sql, params + [limit]).fetchall()
+        things = [loads(data) for data, in rows]
+        fields = payload.get('filter')
+        if fields:
+            fields = _values(fields)
+            things = [{k: thing[k] for k in fields if k in thing} for thing in things]
+        return things
+
+    def aggregate(self, kind, payload):
+        """
+        Counts of the things matching search arguments by the values of each field in
+        ``payload['aggs']``, in the form PushShift returns them. Fields may be ``author``,
+        ``subreddit``, ``link_id`` and ``created_utc``, counted in buckets of ``payload['frequency']``.
+
+        :param kind: 'comment' or 'submission'
+        :param payload: dict
+        :return: dict
+        """
+        table = self._table(kind)
+        where, params = self._where(kind, {k: v for k, v in payload.items()
+                                           if k not in ('aggs', 'frequency', 'limit', 'size', 'sort')})
+        aggs = {}
+        for field in _values(payload['aggs']):
+            if field == 'created_utc':
+                frequency = payload.get('frequency', 'day')
+                if frequency not in _frequency_secs:
+                    raise ValueError("frequency must be one of {}".format(sorted(_frequency_secs)))
+                key = 'created_utc - created_utc % {}'.format(_frequency_secs[frequency])
+                order = 'ORDER BY 1'
+            elif field in ('author', 'subreddit', 'link_id'):
+                key, order = field, 'ORDER BY 2 DESC'
+            else:
+                raise NotImplementedError("Archives can't aggregate by {}.".format(field))
+            sql = 'SELECT {}, COUNT(*) FROM {}{} GROUP BY 1 {}'.format(key, table, where, order)
+            with self._lock:
+                rows = self._conn.execute(sql, params).fetchall()
+            aggs[field] = [{'key': value, 'doc_count': count} for value, count in rows]
+        return aggs
+
+    def comment_ids(self, submission_id):
+        """
+        Ids of the stored comments on a submission
+
+        :param submission_id: str
+        :return: list[str]
+        """
+        link_id = 't3_' + _fullname_prefix.sub('', submission_id)
+        with self._lock:
+            rows = self._conn.execute('SELECT id FROM comments WHERE link_id = ? ORDER BY created_utc',
+                                      (link_id,)).fetchall()
+        return [id for id, in rows]
+
+
+_search_endpoint = re.compile(r'/(comment|submission)/search/?$')
+_comment_ids_endpoint = re.compile(r'/submission/comment_ids/(\w+)$')
+
+
+class LocalPushshiftAPI(PushshiftAPI):
+    def __init__(self, archive='psaw_archive.sqlite', **kwargs):
+        """
+        Client answering searches from an :class:`Archive` instead of PushShift, with no network
+        access. Search methods take the same arguments as those of :class:`psaw.PushshiftAPI`.
+        The search arguments answered are `q`, `author`, `subreddit`, `link_id`, `ids`, `after`,
+        `before`, `sort`, `limit`, `filter` and `aggs` (on `author`, `subreddit`, `link_id` or
+        `created_utc`); any other raises NotImplementedError.
+
+        :param archive: Archive to search, or the path of one, defaults to 'psaw_archive.sqlite'.
+        :type archive: :class:`Archive` or str, optional
+
+        Remaining keyword arguments are the same as for :class:`psaw.PushshiftAPI`, except that
+        `exact_paging` defaults to True.
+        """
+        self._owns_archive = not isinstance(archive, Archive)
+        self.archive = Archive(archive) if self._owns_archive else archive
+        # Nothing is requested over the network, so requests needn't even be imported.
+        kwargs.setdefault('transport', Transport())
+        kwargs['stream_responses'] = False
+        # Archived things are often far denser per second than a live page, so page on
+        # (created_utc, id) unless told otherwise.
+        kwargs.setdefault('exact_paging', True)
+        super().__init__(**kwargs)
+
+    def close(self):
+        if self._owns_archive:
+            self.archive.close()
+
+    def _get(self, url, payload={}, stream=False):
+        log.debug('URL: %s' % url)
+        log.debug('Payload: %s' % payload)
+        start = time.time()
+        match = _comment_ids_endpoint.search(url)
+        if match:
+            response = {'data': self.archive.comment_ids(match.group(1))}
+        else:
+            match = _search_endpoint.search(url)
+            if match is None:
+                raise NotImplementedError("Archives can't answer requests to {}".format(url))
+            kind = match.group(1)
+            data = self.archive.search(kind, payload)
+            response = {'data': data, 'metadata': {'size': len(data)}}
+            if payload.get('aggs'):
+                response['aggs'] = self.archive.aggregate(kind, payload)
+            self.metrics.incr('items_decoded_total', len(data))
+        self.metrics.observe('request_seconds', time.time() - start)
+        return response
@@ -0,0 +1,168 @@
+"""
+Persistent on-disk cache of raw PushShift responses.
+"""
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+
+log = logging.getLogger(__name__)
+
+
+# The size of all entries is kept in total_size by triggers, so that it is right for every
+# process sharing the file and checking it doesn't mean summing the whole table.
+_schema = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires);
+CREATE TABLE IF NOT EXISTS total_size (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    bytes INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses BEGIN
+    UPDATE total_size SET bytes = bytes + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses BEGIN
+    UPDATE total_size SET bytes = bytes - old.size;
+END;
+CREATE TRIGGER IF NOT EXISTS responses_update AFTER UPDATE OF size ON responses BEGIN
+    UPDATE total_size SET bytes = bytes - old.size + new.size;
+END;
+-- Caches made before the running total existed start from their current size.
+INSERT OR IGNORE INTO total_size SELECT 0, COALESCE(SUM(size), 0) FROM responses;
+"""
+
+
+class ResponseCache(object):
+    """
+    SQLite-backed response cache with per-entry expiry and least-recently-used eviction.
+    Safe to share between threads, and between processes using the same file.
+
+    Entries for requests whose time window lies entirely in the past (``before`` older than
+    `settle_secs`) are kept for `historical_ttl`, since those results no longer change. All other
+    entries, including those for relative windows like ``before='30d'``, expire after `recent_ttl`.
+
+    :param path: Location of the SQLite database, defaults to 'psaw_cache.sqlite'.
+    :type path: str, optional
+
+    :param max_bytes: Maximum total size of stored (compressed) responses, defaults to 1 GiB.
+    :type max_bytes: int, optional
+
+    :param recent_ttl: Seconds to keep responses for windows reaching into the recent past, defaults to 600.
+    :type recent_ttl: int or float, optional
+
+    :param historical_ttl: Seconds to keep responses for settled windows, defaults to None (no expiry).
+    :type historical_ttl: int or float, optional
+
+    :param settle_secs: Age after which an item's window is considered settled, defaults to 86400 (1 day).
+    :type settle_secs: int, optional
+    """
+    def __init__(self,
+                 path='psaw_cache.sqlite',
+                 max_bytes=2**30,
+                 recent_ttl=600,
+                 historical_ttl=None,
+                 settle_secs=86400):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.recent_ttl = recent_ttl
+        self.historical_ttl = historical_ttl
+        self.settle_secs = settle_secs
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # INSERT OR REPLACE only fires the delete trigger for the replaced row with this on.
+        self._conn.execute('PRAGMA recursive_triggers = ON')
+        try:
+            self._conn.executescript('BEGIN IMMEDIATE;' + _schema + 'COMMIT;')
+        except BaseException:
+            if self._conn.in_transaction:
+                self._conn.execute('ROLLBACK')
+            raise
+
+    def ttl_for(self, before=None, now=None):
+        """
+        Time to live for a response to a request with the given upper time bound
+
+        :param before: int epoch, or None if the request is unbounded
+        :param now: float
+        :return: float or None
+        """
+        if now is None:
+            now = time.time()
+        if before is not None and before < now - self.settle_secs:
+            return self.historical_ttl
+        return self.recent_ttl
+
+    def get(self, key):
+        """
+        Cached response body for `key`, or None if absent or expired
+
+        :param key: str
+        :return: bytes or None
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT body, expires FROM responses WHERE key = ?',
+                                     (key,)).fetchone()
+            if row is None:
+                return None
+            body, expires = row
+            if expires is not None and expires < now:
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                return None
+            self._conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        log.debug('Cache hit: %s' % key)
+        return zlib.decompress(body)
+
+    def set(self, key, body, ttl=None):
+        """
+        Store a response body
+
+        :param key: str
+        :param body: bytes
+        :param ttl: float
+            seconds until the entry expires, None to keep until evicted
+        """
+        now = time.time()
+        body = zlib.compress(body, 1)
+        expires = None if ttl is None else now + ttl
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                               (key, body, len(body), expires, now))
+            self._evict(now)
+
+    def _evict(self, now):
+        self._conn.execute('DELETE FROM responses WHERE expires < ?', (now,))
+        total = self._conn.execute('SELECT bytes FROM total_size').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        rows = self._conn.execute('SELECT key, size FROM responses ORDER BY accessed')
+        stale = []
+        for key, size in rows:
+            if excess <= 0:
+                break
+            stale.append((key,))
+            excess -= size
+        log.debug('Evicting %s cached responses' % len(stale))
+        self._conn.executemany('DELETE FROM responses WHERE key = ?', stale)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
@@ -0,0 +1,137 @@
+"""
+Checkpointing of search progress, so long crawls can be resumed after a failure.
+"""
+import copy
+import json
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+
+def _normalize(query):
+    """Round-trip through JSON so queries compare equal to their saved form (e.g. tuples vs lists)."""
+    return json.loads(json.dumps(query, sort_keys=True))
+
+
+class Checkpoint(object):
+    """
+    JSON state file recording a search's query, paging cursor and the number of items emitted.
+
+    Pass to a search method as ``checkpoint=Checkpoint(path)``. If the file holds an unfinished
+    search with the same query, paging resumes from the saved cursor. Otherwise a new search is
+    started and recorded. State is written after every `every` pages the consumer has finished
+    with, so resuming may repeat up to `every` pages, but never skips any.
+
+    :param path: Location of the state file.
+    :type path: str
+
+    :param every: Number of pages between saves, defaults to 1.
+    :type every: int, optional
+
+    :param on_save: Called before each save, e.g. to flush output written so far.
+    :type on_save: callable, optional
+    """
+    def __init__(self, path, every=1, on_save=None):
+        self.path = path
+        self.every = every
+        self.on_save = on_save
+        self.state = None
+        self._pages = 0
+
+    def load(self):
+        """
+        Saved state, or None if there is no state file
+
+        :return: dict
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, encoding='utf8') as f:
+            return json.load(f)
+
+    def save(self):
+        if self.on_save is not None:
+            self.on_save()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+        log.debug('Saved checkpoint to %s: %s' % (self.path, self.state))
+
+    def clear(self):
+        """
+        Delete the state file
+
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.state = None
+
+    @staticmethod
+    def matches(state, kind, dataset, query):
+        """
+        Whether saved `state` records the given search
+
+        :param state: dict or None
+        :param kind: str
+        :param dataset: str
+        :param query: dict
+        :return: bool
+        """
+        if state is None:
+            return False
+        return (state['kind'], state['dataset'], state['query']) == (kind, dataset, _normalize(query))
+
+    def start(self, kind, dataset, query):
+        """
+        Begin recording a search, returning its saved state if it is being resumed
+
+        :param kind: str
+        :param dataset: str
+        :param query: dict
+            search arguments as passed by the caller
+        :return: dict or None
+        """
+        query = _normalize(query)
+        self._pages = 0
+        state = self.load()
+        if self.matches(state, kind, dataset, query):
+            log.info("Resuming search from checkpoint %s after %s items" % (self.path, state['emitted']))
+            self.state = state
+            return state
+        self.state = {
+            'kind': kind,
+            'dataset': dataset,
+            'query': query,
+            'payload': None,
+            'limit': query.get('limit'),
+            'emitted': 0,
+            'cursor': None,
+            'complete': False,
+        }
+        return None
+
+    def update(self, payload, limit, n_results, complete=False, cursor=None):
+        """
+        Record a page the consumer has finished with
+
+        :param payload: dict
+            request payload, with the cursor already advanced past the page
+        :param limit: int or None
+            number of items still to be fetched
+        :param n_results: int
+            number of items in the page
+        :param complete: bool
+            whether this was the final page
+        :param cursor: dict or None
+            with ``exact_paging``, the boundary second and the ids already emitted from it
+        """
+        self.state['payload'] = copy.deepcopy(payload)
+        self.state['cursor'] = cursor
+        self.state['limit'] = limit
+        self.state['emitted'] += n_results
+        self.state['complete'] = complete
+        self._pages += 1
+        if complete or self._pages % self.every == 0:
+            self.save()
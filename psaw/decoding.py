@@ -0,0 +1,183 @@
+"""
+JSON decoding for PushShift responses.
+
+``loads`` uses the fastest parser available (orjson, then ujson, then the standard library) and
+accepts the raw response bytes, so the body is never copied into an intermediate ``str``.
+``StreamedResponse`` decodes a response incrementally, yielding the items of its ``data`` array as
+they arrive.
+"""
+import codecs
+import json
+import re
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        loads = ujson.loads
+    except ImportError:
+        loads = json.loads
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+class _Reader(object):
+    """
+    Incrementally decodes JSON values from an iterable of byte chunks
+
+    """
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """
+        Append the next chunk to the buffer, returning False once the input is exhausted
+
+        """
+        if self.eof:
+            return False
+        try:
+            chunk = self._utf8.decode(next(self._chunks))
+        except StopIteration:
+            chunk = self._utf8.decode(b'', final=True)
+            self.eof = True
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Next non-whitespace character, without consuming it
+
+        """
+        while True:
+            self.pos = _whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON input")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Expected {!r} at position {} of JSON input".format(char, self.pos))
+        self.pos += 1
+
+    def value(self):
+        """
+        Decode and consume the next complete JSON value
+
+        """
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+                # A value running to the end of the buffer (e.g. a number) may
+                # continue in the next chunk.
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except ValueError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+class StreamedItems(object):
+    """
+    Single-pass iterable over a streamed array. Once exhausted, ``count`` holds the number of
+    items and ``last`` the final item, including any skipped by :meth:`filter`.
+
+    """
+    def __init__(self, items):
+        self._items = items
+        self._predicate = None
+        self.count = 0
+        self.last = None
+
+    def filter(self, predicate):
+        """Only yield items for which `predicate` is true. Returns self."""
+        self._predicate = predicate
+        return self
+
+    def __iter__(self):
+        predicate = self._predicate
+        for item in self._items:
+            self.count += 1
+            self.last = item
+            if predicate is None or predicate(item):
+                yield item
+
+
+class StreamedResponse(dict):
+    """
+    Response dict whose ``key`` array is decoded lazily. Keys that precede the array in the
+    response are available immediately; keys that follow it (e.g. ``metadata``) are filled in
+    once ``self[key]`` has been iterated to completion.
+
+    :param chunks: Iterable of response body byte chunks.
+    :param key: str
+    """
+    def __init__(self, chunks, key='data'):
+        super().__init__()
+        self._reader = _Reader(chunks)
+        self._reader.expect('{')
+        if self._read_fields(until=key):
+            self[key] = StreamedItems(self._iter_array())
+        else:
+            self[key] = StreamedItems(iter(()))
+
+    def _read_fields(self, until=None):
+        """
+        Read top-level fields into self, stopping early when the key `until` is reached
+
+        """
+        reader = self._reader
+        while True:
+            char = reader.peek()
+            if char == '}':
+                reader.pos += 1
+                return False
+            if char == ',':
+                reader.pos += 1
+            key = reader.value()
+            reader.expect(':')
+            if key == until:
+                return True
+            self[key] = reader.value()
+
+    def _iter_array(self):
+        reader = self._reader
+        reader.expect('[')
+        if reader.peek() == ']':
+            reader.pos += 1
+        else:
+            while True:
+                yield reader.value()
+                char = reader.peek()
+                reader.pos += 1
+                if char == ']':
+                    break
+                if char != ',':
+                    raise ValueError("Malformed array in JSON input")
+        self._read_fields()
+
+
+def page_tail(results):
+    """
+    Number of items in a page of results and its last item
+
+    :param results: list or exhausted :class:`StreamedItems`
+    :return: int, dict
+    """
+    if isinstance(results, StreamedItems):
+        return results.count, results.last
+    if results:
+        return len(results), results[-1]
+    return 0, None
@@ -0,0 +1,62 @@
+"""
+Memory-bounded de-duplication of search results.
+"""
+from hashlib import blake2b
+import math
+
+
+class BloomFilter(object):
+    """
+    Probabilistic set of item IDs for de-duplicating very long crawls without holding every ID
+    in memory. Never reports a new ID as seen twice, but reports an unseen ID as already seen
+    (so drops it) with probability up to `error_rate` once `capacity` IDs have been added.
+
+    Memory use is about ``-capacity * ln(error_rate) / ln(2)**2`` bits, e.g. ~29 bits per ID
+    at an error rate of 1e-6.
+
+    :param capacity: Number of distinct IDs the filter is sized for.
+    :type capacity: int
+
+    :param error_rate: False positive rate at capacity, defaults to 1e-6.
+    :type error_rate: float, optional
+    """
+    def __init__(self, capacity, error_rate=1e-6):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.n_bits = max(int(math.ceil(-capacity * math.log(error_rate) / math.log(2)**2)), 8)
+        self.n_hashes = max(int(round(self.n_bits / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.n_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = blake2b(str(key).encode('utf8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        n_bits = self.n_bits
+        return [(h1 + i*h2) % n_bits for i in range(self.n_hashes)]
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key):
+        """
+        Add `key` to the filter
+
+        :param key: str
+        :return: bool
+            True if `key` was not already (probably) present
+        """
+        bits = self.bits
+        new = False
+        for p in self._positions(key):
+            mask = 1 << (p & 7)
+            if not bits[p >> 3] & mask:
+                bits[p >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __len__(self):
+        return self.count
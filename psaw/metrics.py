@@ -0,0 +1,229 @@
+"""
+Counters and timings describing a client's requests, for finding out whether a crawl is
+limited by the network, the rate limit or local CPU.
+
+Every :class:`~psaw.PushshiftAPIMinimal` records into a :class:`Metrics` instance, available
+as ``api.metrics`` and summarized by ``api.stats()``. Pass ``metrics=Metrics(...)`` to share one
+between clients. The metrics recorded are:
+
+* ``requests_total`` by status ``code`` (``error`` for failed connections)
+* ``request_seconds``, a histogram of request latency
+* ``response_bytes_total``, bytes of response bodies received
+* ``items_decoded_total``, results decoded from responses
+* ``retries_total``, requests repeated after a failure
+* ``rate_limit_wait_seconds_total`` and ``backoff_seconds_total``, time spent waiting before requests
+* ``decode_seconds_total`` and ``wrap_seconds_total``, time spent decoding JSON and wrapping results
+* ``shards_down_total`` and ``cache_hits_total``
+"""
+import bisect
+import threading
+import time
+
+# Upper bounds of the request latency histogram buckets, in seconds.
+_default_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_help = {
+    'requests_total': "Requests sent, by response status code.",
+    'request_seconds': "Request latency in seconds.",
+    'response_bytes_total': "Bytes of response bodies received.",
+    'items_decoded_total': "Results decoded from responses.",
+    'retries_total': "Requests repeated after a failure.",
+    'rate_limit_wait_seconds_total': "Seconds spent waiting for the rate limiter.",
+    'backoff_seconds_total': "Seconds spent backing off before retries.",
+    'decode_seconds_total': "Seconds spent decoding JSON responses.",
+    'wrap_seconds_total': "Seconds spent converting results to records or batches.",
+    'shards_down_total': "Responses reporting that not all shards were active.",
+    'cache_hits_total': "Requests answered from the response cache.",
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items())) if labels else ()
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in pairs) + '}'
+
+
+class Metrics(object):
+    """
+    Thread-safe counters and histograms, with hooks called on every update.
+
+    :param buckets: Upper bounds of histogram buckets in seconds, defaults to 0.05s to 60s.
+    :type buckets: tuple, optional
+
+    :param hooks: Callables passed ``(name, value, labels)`` on every update, e.g. to forward
+        metrics to statsd. They are called on the thread that made the request, so should be quick.
+    :type hooks: list, optional
+    """
+    def __init__(self, buckets=_default_buckets, hooks=None):
+        self.buckets = tuple(sorted(buckets))
+        self.hooks = list(hooks or [])
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def add_hook(self, hook):
+        """
+        Call `hook` with ``(name, value, labels)`` on every update
+
+        :param hook: callable
+        """
+        self.hooks.append(hook)
+
+    def incr(self, name, value=1, **labels):
+        """
+        Add `value` to a counter
+
+        :param name: str
+        :param value: int or float
+        :param labels: label values by name
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        for hook in self.hooks:
+            hook(name, value, labels)
+
+    def observe(self, name, value, **labels):
+        """
+        Record `value` in a histogram
+
+        :param name: str
+        :param value: float
+        :param labels: label values by name
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0, 0.0, [0] * (len(self.buckets) + 1)]
+            histogram[0] += 1
+            histogram[1] += value
+            histogram[2][bisect.bisect_left(self.buckets, value)] += 1
+        for hook in self.hooks:
+            hook(name, value, labels)
+
+    def reset(self):
+        """
+        Clear all metrics
+
+        """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started = time.time()
+
+    def total(self, name):
+        """
+        Value of a counter, or the sum of a histogram, summed over all labels
+
+        :param name: str
+        :return: float
+        """
+        with self._lock:
+            return (sum(v for (n, _), v in self._counters.items() if n == name) +
+                    sum(h[1] for (n, _), h in self._histograms.items() if n == name))
+
+    def stats(self):
+        """
+        Snapshot of every metric. Labelled metrics are dicts keyed by their label values, and
+        histograms are dicts of ``count``, ``sum`` and cumulative ``buckets``.
+
+        :return: dict
+        """
+        stats = {'elapsed_seconds': time.time() - self.started}
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = [(key, (count, total, list(buckets)))
+                          for key, (count, total, buckets) in self._histograms.items()]
+        for (name, labels), value in counters:
+            self._store(stats, name, labels, value)
+        for (name, labels), (count, total, buckets) in histograms:
+            cumulative, n = {}, 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), buckets):
+                n += bucket
+                cumulative[bound] = n
+            self._store(stats, name, labels, {'count': count, 'sum': total, 'buckets': cumulative})
+        return stats
+
+    @staticmethod
+    def _store(stats, name, labels, value):
+        if not labels:
+            stats[name] = value
+            return
+        values = tuple(v for _, v in labels)
+        stats.setdefault(name, {})[values[0] if len(values) == 1 else values] = value
+
+    def to_prometheus(self, namespace='psaw'):
+        """
+        Metrics in the Prometheus text exposition format
+
+        :param namespace: str
+            prefix of every metric name
+        :return: str
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (count, total, list(buckets)))
+                                for key, (count, total, buckets) in self._histograms.items())
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in _help:
+                    lines.append('# HELP {}_{} {}'.format(namespace, name, _help[name]))
+                lines.append('# TYPE {}_{} {}'.format(namespace, name, kind))
+
+        for (name, labels), value in counters:
+            describe(name, 'counter')
+            lines.append('{}_{}{} {!r}'.format(namespace, name, _format_labels(labels), float(value)))
+        for (name, labels), (count, total, buckets) in histograms:
+            describe(name, 'histogram')
+            n = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), buckets):
+                n += bucket
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append('{}_{}_bucket{} {}'.format(namespace, name, _format_labels(labels, [('le', le)]), n))
+            lines.append('{}_{}_sum{} {!r}'.format(namespace, name, _format_labels(labels), float(total)))
+            lines.append('{}_{}_count{} {}'.format(namespace, name, _format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+
+def start_http_server(metrics, port, address='', namespace='psaw'):
+    """
+    Serve `metrics` for Prometheus to scrape from a background daemon thread
+
+    :param metrics: Metrics
+    :param port: int
+    :param address: str
+    :param namespace: str
+    :return: http.server.ThreadingHTTPServer
+        call ``shutdown()`` to stop serving
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = self.server.metrics.to_prometheus(self.server.namespace).encode('utf8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    server.namespace = namespace
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,135 @@
+"""
+Planning of long searches from the distribution of their results over time.
+"""
+import math
+
+# Bucket widths for PushShift's `frequency` values. Months and years vary in length,
+# so these are only used for the final bucket of a histogram.
+_frequency_secs = {
+    'second': 1,
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+    'week': 604800,
+    'month': 2629746,
+    'year': 31556952,
+}
+
+
+def histogram_buckets(aggs, frequency, after=None, before=None):
+    """
+    Convert a PushShift ``created_utc`` aggregation into ``(start, end, count)`` buckets, each
+    covering the seconds from `start` up to but excluding `end`, clipped to the open interval
+    (`after`, `before`).
+
+    :param aggs: list of dict
+        ``{'key': epoch, 'doc_count': int}`` records, as returned for ``aggs='created_utc'``
+    :param frequency: str
+    :param after: int
+    :param before: int
+    :return: list of tuple
+    """
+    records = sorted(aggs, key=lambda rec: rec['key'])
+    # Elasticsearch reports bucket keys in milliseconds unless PushShift converts them.
+    keys = [rec['key'] // 1000 if rec['key'] > 10**11 else rec['key'] for rec in records]
+    ends = keys[1:] + [keys[-1] + _frequency_secs[frequency]] if keys else []
+    buckets = []
+    for start, end, rec in zip(keys, ends, records):
+        if after is not None:
+            start = max(start, after + 1)
+        if before is not None:
+            end = min(end, before)
+        if end > start:
+            buckets.append((int(start), int(end), rec['doc_count']))
+    return buckets
+
+
+def count_between(buckets, start, end):
+    """
+    Estimated number of items created from `start` up to but excluding `end`, assuming items
+    are spread evenly within each bucket
+
+    :param buckets: list of tuple
+    :param start: int
+    :param end: int
+    :return: float
+    """
+    total = 0
+    for b_start, b_end, count in buckets:
+        overlap = min(end, b_end) - max(start, b_start)
+        if overlap > 0:
+            total += count * overlap / (b_end - b_start)
+    return total
+
+
+def _quantile(buckets, target):
+    """Earliest second by which about `target` items have been created."""
+    seen = 0
+    for start, end, count in buckets:
+        if count > 0 and seen + count >= target:
+            return int(round(start + (target - seen) / count * (end - start)))
+        seen += count
+    return buckets[-1][1]
+
+
+class CrawlPlan(object):
+    """
+    Expected size of a search, and time windows that split it into parts with about the same
+    number of results, estimated from a histogram of when its results were created.
+
+    Pass to a search as ``plan=...`` together with ``workers`` to page the windows concurrently.
+
+    :param buckets: Histogram of ``(start, end, count)`` buckets, as from :func:`histogram_buckets`.
+    :type buckets: list
+
+    :param after: Exclusive lower bound of the search.
+    :type after: int
+
+    :param before: Exclusive upper bound of the search.
+    :type before: int
+
+    :param n_windows: Number of windows to split the search into.
+    :type n_windows: int
+
+    :param page_size: Number of results per request, defaults to 1000.
+    :type page_size: int, optional
+
+    :param rate_limit_per_minute: Requests allowed per minute, used to estimate how long the search will take.
+    :type rate_limit_per_minute: int, optional
+    """
+    def __init__(self, buckets, after, before, n_windows, page_size=1000, rate_limit_per_minute=None):
+        self.buckets = buckets
+        self.after = after
+        self.before = before
+        self.page_size = page_size
+        self.rate_limit_per_minute = rate_limit_per_minute
+        self.total = sum(count for _, _, count in buckets)
+
+        cuts = []
+        if self.total > 0:
+            for i in range(1, n_windows):
+                cut = _quantile(buckets, self.total * i / n_windows)
+                if after + 1 < cut < before and (not cuts or cut > cuts[-1]):
+                    cuts.append(cut)
+        # Windows are (after, before) pairs, exclusive at both ends as PushShift treats them.
+        starts = [after + 1] + cuts
+        ends = cuts + [before]
+        self.windows = [(start - 1, end) for start, end in zip(starts, ends)]
+        self.counts = [int(round(count_between(buckets, start, end))) for start, end in zip(starts, ends)]
+
+    @property
+    def n_requests(self):
+        """Expected number of requests, counting the empty page that ends each window."""
+        return sum(math.ceil(count / self.page_size) + 1 for count in self.counts)
+
+    @property
+    def eta(self):
+        """Expected duration of the search in seconds, if the rate limit is known."""
+        if not self.rate_limit_per_minute:
+            return None
+        return self.n_requests * 60 / self.rate_limit_per_minute
+
+    def __repr__(self):
+        return '<CrawlPlan: ~{} items in {} windows, ~{} requests, eta {}s>'.format(
+            self.total, len(self.windows), self.n_requests,
+            None if self.eta is None else int(self.eta))
@@ -1,12 +1,45 @@
 import click
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import json
+import os
+import threading
+import time
 from .PushshiftAPI import PushshiftAPI
+from .checkpoint import Checkpoint
 from . import writers as wt
 from . import utilities as ut
 from pathlib import Path
 import pprint
 
 
-@click.command(context_settings=dict(max_content_width=100))
+class DefaultCommandGroup(click.Group):
+    """
+    Group that runs `default_command` unless the first argument names another command,
+    so that ``psaw comments ...`` keeps working alongside ``psaw batch ...``. A leading
+    ``--help`` shows the group's help, listing every command.
+
+    """
+    def __init__(self, *args, default_command=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx, args):
+        if not args or (args[0] not in self.commands and args[0] not in ctx.help_option_names):
+            args = [self.default_command] + list(args)
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultCommandGroup, default_command='search')
+def cli():
+    """
+    search reddit through pushshift
+
+    """
+    pass
+
+
+@cli.command(context_settings=dict(max_content_width=100))
 @click.argument('search_type', type=click.Choice(['comments', 'submissions']), default='comments')
 @click.option("-q", "--query", help='search term(s)', type=str)
 @click.option("-s", "--subreddits", help='restrict search to subreddit(s)', type=str)
@@ -30,7 +63,26 @@ import pprint
               'output_path/{subreddit}_{created_utc}.json'
 
               """)
-@click.option('--format', type=click.Choice(['json', 'csv']), default='csv')
+@click.option("--partition", is_flag=True, default=False,
+              help="append results to the file named by --output-template, eg "
+                   "'output_path/{subreddit}.csv', instead of writing a file per result")
+@click.option("--max-open-files", default=128,
+              help="partition files kept open at once with --partition")
+@click.option('--format', type=click.Choice(['json', 'csv', 'ndjson', 'parquet', 'arrow']), default='csv',
+              help="parquet and arrow require pyarrow. ndjson is compressed for "
+                   "--output names ending in .gz or .zst (requires zstandard)")
+@click.option("--row-group-size", default=100000,
+              help="rows buffered per row group (parquet and arrow only)")
+@click.option("--column-type", "column_types", multiple=True, metavar="FIELD=TYPE",
+              help="store FIELD as a pyarrow TYPE such as string or float64 instead of inferring "
+                   "it from the first row group (parquet and arrow only, repeatable)")
+@click.option("--shard-records", type=int, default=None,
+              help="start a new ndjson output file after this many results; "
+                   "--output must contain a {shard} field, eg out-{shard:05d}.ndjson.zst")
+@click.option("--shard-bytes", type=int, default=None,
+              help="start a new ndjson output file after this many bytes (before compression)")
+@click.option("--background-write", is_flag=True, default=False,
+              help="serialize and write results on a background thread while fetching continues")
 @click.option("-f", "--filter", "filter_", type=str,
               help="filter fields to retrieve (must be in quotes or have no spaces), defaults to all")
 @click.option("--prettify", is_flag=True, default=False,
@@ -39,13 +91,33 @@ import pprint
               help="print potential names of output files, but don't actually write any files")
 @click.option("--no-output-template-check", is_flag=True, default=False)
 @click.option("--proxy", type=str, default=None)
+@click.option("--archive", "archive_path", type=click.Path(exists=True, dir_okay=False),
+              help="search a local archive filled by psaw sync instead of pushshift.io")
+@click.option("--checkpoint", "checkpoint_path", type=click.Path(),
+              help="state file recording search progress, so an interrupted search can be resumed")
+@click.option("--checkpoint-every", default=1,
+              help="number of pages between checkpoint saves")
+@click.option("--resume", is_flag=True, default=False,
+              help="resume the search recorded in --checkpoint, appending to --output")
+@click.option("--workers", default=1,
+              help="number of time windows to fetch concurrently (requires --after)")
+@click.option("--plan", is_flag=True, default=False,
+              help="estimate the number of results first, to size the progress bar "
+                   "and balance --workers windows")
+@click.option("--stats", "show_stats", is_flag=True, default=False,
+              help="print request counts and where time was spent when done")
 @click.option("--verbose", is_flag=True, default=False)
-def cli(search_type, query, subreddits, authors, limit, before, after,
-        output, output_template, format, filter_, prettify, dry_run,
-        no_output_template_check, proxy, verbose):
+def search(search_type, query, subreddits, authors, limit, before, after,
+        output, output_template, partition, max_open_files, format, row_group_size, column_types,
+        shard_records, shard_bytes,
+        background_write, filter_, prettify, dry_run,
+        no_output_template_check, proxy, archive_path, checkpoint_path, checkpoint_every,
+        resume, workers, plan, show_stats, verbose):
     """
     retrieve comments or submissions from reddit which meet given criteria
 
+    to run many searches at once, see psaw batch --help
+
     """
 
     if output is None and output_template is None:
@@ -54,6 +126,34 @@ def cli(search_type, query, subreddits, authors, limit, before, after,
     if output is not None and output_template is not None:
         raise click.UsageError("can only supply --output or --output-template, not both")
 
+    if partition and output_template is None:
+        raise click.UsageError("--partition requires --output-template")
+
+    if partition and format in ('parquet', 'arrow'):
+        raise click.UsageError("--partition isn't supported for {} output".format(format))
+
+    if resume and checkpoint_path is None:
+        raise click.UsageError("--resume requires --checkpoint")
+
+    if checkpoint_path is not None and workers > 1:
+        raise click.UsageError("--checkpoint can't be combined with --workers")
+
+    if checkpoint_path is not None and format in ('parquet', 'arrow'):
+        raise click.UsageError("--checkpoint isn't supported for {} output".format(format))
+
+    if (shard_records is not None or shard_bytes is not None) and format != 'ndjson':
+        raise click.UsageError("--shard-records and --shard-bytes require --format ndjson")
+
+    if (shard_records is not None or shard_bytes is not None) and output_template is not None and not partition:
+        raise click.UsageError("--shard-records and --shard-bytes require --output or --partition")
+
+    if column_types and format not in ('parquet', 'arrow'):
+        raise click.UsageError("--column-type requires --format parquet or arrow")
+    try:
+        column_types = dict(column_type.split('=', 1) for column_type in column_types)
+    except ValueError:
+        raise click.BadParameter("column types must be given as FIELD=TYPE", param_hint="--column-type")
+
     verbose = verbose or dry_run
 
     if output:
@@ -61,7 +161,11 @@ def cli(search_type, query, subreddits, authors, limit, before, after,
     else:
         batch_mode = False
 
-    api = PushshiftAPI(https_proxy=proxy)
+    if archive_path is not None:
+        from .archive import LocalPushshiftAPI
+        api = LocalPushshiftAPI(archive_path)
+    else:
+        api = PushshiftAPI(https_proxy=proxy)
     search_args = dict()
 
     query = ut.string_to_list(query)
@@ -93,6 +197,35 @@ def cli(search_type, query, subreddits, authors, limit, before, after,
         click.echo("calling api with following arguments:")
         click.echo(pprint.pformat(search_args))
 
+    count = limit
+    if plan:
+        crawl_plan = api.plan_search(kind=search_type[:-1], windows=workers, **search_args)
+        click.secho("expecting ~{} results in ~{} requests{}".format(
+            crawl_plan.total, crawl_plan.n_requests,
+            '' if crawl_plan.eta is None else ', about {:.0f}s'.format(crawl_plan.eta)), err=True)
+        count = crawl_plan.total if limit is None else min(limit, crawl_plan.total)
+        search_args['plan'] = crawl_plan
+    if workers > 1:
+        search_args['workers'] = workers
+
+    checkpoint = None
+    if checkpoint_path is not None and not dry_run:
+        checkpoint = Checkpoint(checkpoint_path, every=checkpoint_every)
+        if resume:
+            state = checkpoint.load()
+            if state is None:
+                raise click.BadParameter("no checkpoint found at {}".format(checkpoint_path))
+            query = ut.slice_dict(search_args, set(search_args) - {'plan'})
+            if not checkpoint.matches(state, search_type[:-1], 'reddit', query):
+                raise click.BadParameter("checkpoint at {} was recorded for a different "
+                                         "search".format(checkpoint_path))
+            if state['complete']:
+                click.secho("checkpointed search is already complete", err=True, bold=True)
+                return
+        else:
+            checkpoint.clear()
+        search_args['checkpoint'] = checkpoint
+
     things = search_functions(**search_args)
     thing, things = ut.peek_first_item(things)
     if thing is None:
@@ -106,18 +239,40 @@ def cli(search_type, query, subreddits, authors, limit, before, after,
         click.secho("server did not return following fields: {}".format(missing_fields),
                     bold=True, err=True)
 
-    writer_class = choose_writer_class(format, batch_mode)
-    writer = writer_class(fields=fields, prettify=prettify)
+    writer_class = choose_writer_class(format, batch_mode or partition)
+    make_writer = functools.partial(writer_class, fields=fields, prettify=prettify,
+                                    row_group_size=row_group_size, column_types=column_types,
+                                    max_records=shard_records, max_bytes=shard_bytes)
+    if partition:
+        writer = wt.PartitionedWriter(make_writer, max_open=max_open_files)
+    else:
+        writer = make_writer()
+    if batch_mode or partition:
+        writer = wt.BufferedWriter(writer, background=background_write)
+    if checkpoint is not None and (batch_mode or partition):
+        # files written one per thing are already closed by the time a page is checkpointed
+        checkpoint.on_save = writer.flush
 
     if batch_mode:
         save_to_single_file(things, output, writer=writer,
-                            count=limit, verbose=verbose, dry_run=dry_run)
+                            count=count, verbose=verbose, dry_run=dry_run,
+                            append=resume)
+    elif partition:
+        if not no_output_template_check:
+            validate_output_template(output_template)
+
+        save_to_partitions(things, output_template, writer=writer,
+                           count=count, verbose=verbose, dry_run=dry_run,
+                           append=resume)
     else:
         if not no_output_template_check:
             validate_output_template(output_template)
 
         save_to_multiple_files(things, output_template, writer=writer,
-                               count=limit, verbose=verbose, dry_run=dry_run)
+                               count=count, verbose=verbose, dry_run=dry_run)
+
+    if show_stats:
+        echo_stats(api)
 
 
 def choose_writer_class(format, batch_mode):
@@ -134,13 +289,19 @@ def choose_writer_class(format, batch_mode):
         ('json', True): wt.JsonBatchWriter,
         ('csv', False): wt.CsvWriter,
         ('csv', True): wt.CsvBatchWriter,
+        ('ndjson', False): wt.NdjsonWriter,
+        ('ndjson', True): wt.NdjsonWriter,
+        ('parquet', False): wt.ParquetWriter,
+        ('parquet', True): wt.ParquetWriter,
+        ('arrow', False): wt.ArrowWriter,
+        ('arrow', True): wt.ArrowWriter,
     }[(format, batch_mode)]
 
     return writer_cls
 
 
 def save_to_single_file(things, output_file, writer, count,
-                        verbose=False, dry_run=False):
+                        verbose=False, dry_run=False, append=False):
     """
     Write all things to a single file
 
@@ -150,13 +311,15 @@ def save_to_single_file(things, output_file, writer, count,
     :param count: int
     :param verbose: bool
     :param dry_run: bool
+    :param append: bool
+        continue writing to an existing output file
 
     """
-    count = 0
-    writer.open(output_file)
+    writer.open(output_file, append=append)
     writer.header()
     try:
         with click.progressbar(things, length=count) as things:
+            count = 0
             for thing in things:
                 if not dry_run:
                     writer.write(thing.d_)
@@ -169,6 +332,37 @@ def save_to_single_file(things, output_file, writer, count,
         click.echo("wrote {} items to {}".format(count, output_file))
 
 
+def save_to_partitions(things, output_template, writer, count,
+                       verbose=False, dry_run=False, append=False):
+    """
+    Append things to the partition files named by filling in a template with their fields
+
+    :param things: iterable
+    :param output_template: str
+        template should contain python str format codes, such as "{subreddit}.csv"
+    :param writer: PartitionedWriter
+    :param count: int
+    :param verbose: bool
+    :param dry_run: bool
+    :param append: bool
+        continue writing to existing partition files
+
+    """
+    if dry_run:
+        partitions = set()
+        for thing in things:
+            output_file = output_template.format(**thing.d_)
+            if output_file not in partitions:
+                partitions.add(output_file)
+                click.echo("saving to: {}".format(output_file))
+        return
+
+    save_to_single_file(things, output_template, writer=writer, count=count, append=append)
+
+    if verbose:
+        click.echo("wrote {} items to {} files".format(writer.items, len(writer.partitions)))
+
+
 def save_to_multiple_files(things, output_template, writer, count,
                            verbose=False, dry_run=False):
     """
@@ -189,12 +383,14 @@ def save_to_multiple_files(things, output_template, writer, count,
         progressbar = click.progressbar(things, length=count)
 
     count = 0
+    made_dirs = set()
     with progressbar as things:
         for thing in things:
             output_file = output_template.format(**thing.d_)
-            p = Path(output_file)
-            if not p.parent.exists():
-                p.parent.mkdir(parents=True)
+            parent = Path(output_file).parent
+            if parent not in made_dirs:
+                parent.mkdir(parents=True, exist_ok=True)
+                made_dirs.add(parent)
 
             if dry_run:
                 click.echo("saving to: {}".format(output_file))
@@ -212,6 +408,16 @@ def save_to_multiple_files(things, output_template, writer, count,
         click.echo("wrote {} items".format(count))
 
 
+def echo_stats(api):
+    """
+    Print the api's request metrics to stderr
+
+    :param api: PushshiftAPI
+
+    """
+    click.echo(json.dumps(api.stats(), indent=2, default=str), err=True)
+
+
 def validate_output_template(output_template):
     """
     Crude sanity check that output template looks reasonable
@@ -237,6 +443,262 @@ def validate_output_template(output_template):
                                  "use --no-output-template-check to override check")
 
 
+_search_methods = {
+    'comments': 'search_comments',
+    'submissions': 'search_submissions',
+}
+
+
+def load_jobs(path):
+    """
+    Read search jobs from a YAML file (requires PyYAML) or a file of JSON lines
+
+    A YAML file holds a list of jobs, or a mapping with a list of ``jobs`` and ``defaults``
+    for every job. Each job is a dict of search arguments, plus optionally ``name``,
+    ``type`` ('comments' or 'submissions'), ``format`` and ``output``.
+
+    :param path: str
+    :return: list[dict]
+
+    """
+    with open(path, encoding='utf8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("Reading YAML job files requires PyYAML to be installed.")
+            spec = yaml.safe_load(f)
+        else:
+            spec = [json.loads(line) for line in f if line.strip()]
+
+    defaults = {}
+    if isinstance(spec, dict):
+        defaults = spec.get('defaults') or {}
+        spec = spec.get('jobs') or []
+
+    jobs = []
+    for i, job in enumerate(spec):
+        job = dict(defaults, **job)
+        job.setdefault('name', 'job-{:05d}'.format(i))
+        jobs.append(job)
+    return jobs
+
+
+def job_output(job, output_dir='.', format='csv'):
+    """
+    Output file of a job, defaulting to one named after the job in `output_dir`
+
+    :param job: dict
+    :param output_dir: str
+    :param format: str
+    :return: str
+
+    """
+    format = job.get('format', format)
+    return job.get('output') or os.path.join(output_dir, '{}.{}'.format(job['name'], format))
+
+
+def run_job(api, job, output_dir='.', format='csv', background_write=False):
+    """
+    Run one search job, writing its results to its own output file
+
+    :param api: PushshiftAPI
+        not shared with searches running concurrently, see PushshiftAPI.clone
+    :param job: dict
+        as from load_jobs
+    :param output_dir: str
+    :param format: str
+        format for jobs that don't set one
+    :param background_write: bool
+    :return: dict
+        status of the job: its name, output, status ('ok', 'empty' or 'failed'),
+        number of items written, error and duration
+
+    """
+    output = job_output(job, output_dir, format)
+    search_args = {k: v for k, v in job.items() if k not in ('name', 'type', 'format', 'output')}
+    status = dict(name=job['name'], output=output, status='failed', items=0, error=None)
+    start = time.time()
+    try:
+        search_type = job.get('type', 'comments')
+        if search_type not in _search_methods:
+            raise ValueError("type must be comments or submissions, not {!r}".format(search_type))
+        search_function = getattr(api, _search_methods[search_type])
+        for key in ('after', 'before'):
+            if isinstance(search_args.get(key), str):
+                search_args[key] = ut.string_to_epoch(search_args[key])
+        if isinstance(search_args.get('filter'), str):
+            search_args['filter'] = ut.string_to_list(search_args['filter'])
+
+        things = search_function(**search_args)
+        thing, things = ut.peek_first_item(things)
+        if thing is None:
+            status['status'] = 'empty'
+        else:
+            fields, _ = ut.validate_fields(thing, search_args.get('filter'))
+            writer_class = choose_writer_class(job.get('format', format), True)
+            writer = wt.BufferedWriter(writer_class(fields=fields), background=background_write)
+            parent = os.path.dirname(output)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            writer.open(output)
+            writer.header()
+            try:
+                for thing in things:
+                    writer.write(thing.d_)
+                    status['items'] += 1
+            finally:
+                writer.footer()
+                writer.close()
+            status['status'] = 'ok'
+    except Exception as e:
+        status['error'] = '{}: {}'.format(type(e).__name__, e)
+    status['seconds'] = round(time.time() - start, 3)
+    return status
+
+
+@cli.command(context_settings=dict(max_content_width=100))
+@click.argument('jobs_file', type=click.Path(exists=True, dir_okay=False))
+@click.option("--workers", default=4, help='number of jobs run concurrently')
+@click.option("--output-dir", type=click.Path(file_okay=False), default='.',
+              help="directory for the output of jobs that don't name an output file")
+@click.option('--format', type=click.Choice(['json', 'csv', 'ndjson', 'parquet', 'arrow']), default='csv',
+              help="output format for jobs that don't set one")
+@click.option("-l", "--limit", type=int, default=None,
+              help="maximum number of items to retrieve for jobs that don't set a limit, "
+                   "defaults to all")
+@click.option("--status", "status_path", type=click.Path(),
+              help="file recording the status of each job as JSON lines")
+@click.option("--skip-done", is_flag=True, default=False,
+              help="skip jobs recorded as ok in --status, appending to it")
+@click.option("--background-write", is_flag=True, default=False,
+              help="serialize and write results on a background thread per job")
+@click.option("--proxy", type=str, default=None)
+@click.option("--stats", "show_stats", is_flag=True, default=False,
+              help="print request counts and where time was spent when done")
+def batch(jobs_file, workers, output_dir, format, limit, status_path, skip_done,
+          background_write, proxy, show_stats):
+    """
+    run many searches from a YAML (requires PyYAML) or JSON lines file of jobs,
+    sharing one rate limit
+
+    each job is a mapping of search arguments (q, subreddit, author, after, before,
+    limit, filter, ...) and optionally name, type (comments or submissions), format
+    and output, eg
+
+    {"name": "askscience", "subreddit": "askscience", "after": "7d", "type": "submissions"}
+
+    """
+    if skip_done and status_path is None:
+        raise click.UsageError("--skip-done requires --status")
+
+    jobs = load_jobs(jobs_file)
+    outputs = [job_output(job, output_dir, format) for job in jobs]
+    if len(set(outputs)) < len(outputs):
+        raise click.BadParameter("jobs must have distinct names or outputs")
+
+    if skip_done and os.path.exists(status_path):
+        with open(status_path, encoding='utf8') as f:
+            done = {status['name'] for status in map(json.loads, filter(str.strip, f))
+                    if status['status'] == 'ok'}
+        jobs = [job for job in jobs if job['name'] not in done]
+        click.secho("skipping {} jobs already done".format(len(done)), err=True)
+
+    if limit is not None:
+        for job in jobs:
+            job.setdefault('limit', limit)
+
+    # one instance per thread, all sharing a rate limiter and connection pool
+    api = PushshiftAPI(https_proxy=proxy)
+    local = threading.local()
+
+    def run(job):
+        if not hasattr(local, 'api'):
+            local.api = api.clone()
+        return run_job(local.api, job, output_dir=output_dir, format=format,
+                       background_write=background_write)
+
+    counts = {'ok': 0, 'empty': 0, 'failed': 0}
+    status_file = None
+    if status_path is not None:
+        parent = os.path.dirname(status_path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        status_file = open(status_path, 'a' if skip_done else 'w', encoding='utf8')
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = [executor.submit(run, job) for job in jobs]
+    try:
+        for future in futures:
+            status = future.result()
+            counts[status['status']] += 1
+            click.echo("{status:<6} {name}: {items} items in {seconds}s{error}".format(
+                error='' if status['error'] is None else ' ({})'.format(status['error']),
+                **{k: v for k, v in status.items() if k != 'error'}))
+            if status_file is not None:
+                status_file.write(json.dumps(status) + '\n')
+                status_file.flush()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+        if status_file is not None:
+            status_file.close()
+
+    click.secho("{} jobs: {ok} ok, {empty} empty, {failed} failed".format(len(jobs), **counts),
+                err=True, bold=True)
+    if show_stats:
+        echo_stats(api)
+    if counts['failed']:
+        raise click.ClickException("{} jobs failed".format(counts['failed']))
+
+
+@cli.command(context_settings=dict(max_content_width=100))
+@click.argument('search_type', type=click.Choice(['comments', 'submissions']), default='comments')
+@click.option("--archive", "archive_path", type=click.Path(dir_okay=False),
+              default='psaw_archive.sqlite', help='SQLite archive to update')
+@click.option("-q", "--query", help='search term(s)', type=str)
+@click.option("-s", "--subreddits", help='restrict search to subreddit(s)', type=str)
+@click.option("-a", "--authors", help='restrict search to author(s)', type=str)
+@click.option("--after", help='on the first sync of a search, only fetch results after date '
+                              '(datetime or int + s,m,h,d; eg, 30d for 30 days)', type=str)
+@click.option("-l", "--limit", type=int, default=None,
+              help='maximum number of items to fetch, defaults to all')
+@click.option("--proxy", type=str, default=None)
+@click.option("--stats", "show_stats", is_flag=True, default=False,
+              help="print request counts and where time was spent when done")
+def sync(search_type, archive_path, query, subreddits, authors, after, limit, proxy, show_stats):
+    """
+    fetch comments or submissions newer than those already in a local archive
+    for the same search
+
+    search the archive offline with psaw search --archive
+
+    """
+    from .archive import Archive
+
+    search_args = ut.build_search_kwargs(
+        {},
+        q=ut.string_to_list(query),
+        subreddit=ut.string_to_list(subreddits),
+        author=ut.string_to_list(authors),
+        after=ut.string_to_epoch(after),
+        limit=limit,
+    )
+    # exact paging, so that no item is skipped when a page ends mid-second
+    api = PushshiftAPI(https_proxy=proxy, exact_paging=True)
+    archive = Archive(archive_path)
+    try:
+        n = archive.sync(api, kind=search_type[:-1], **search_args)
+        high_water = archive.high_water(search_type[:-1], **search_args)
+    finally:
+        archive.close()
+    click.secho("stored {} {} in {}{}".format(
+        n, search_type, archive_path,
+        '' if high_water is None else ', newest created at {}'.format(high_water)), err=True)
+    if show_stats:
+        echo_stats(api)
+
+
 if __name__ == '__main__':
     cli()
 
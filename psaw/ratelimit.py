@@ -0,0 +1,265 @@
+"""
+Rate limiters that share one request budget between processes.
+
+Pass one to ``PushshiftAPI(rate_limiter=...)`` in every worker process so that together they
+stay within the server's rate limit instead of each assuming the whole budget for itself.
+
+* :class:`FileRateLimiter` keeps a token bucket in a memory-mapped file guarded by a file lock.
+  Every process on the host that opens the same path shares the bucket. No coordinator is needed.
+* :class:`RateLimitServer` runs a coordinator on a local socket, which
+  :class:`SocketRateLimiter` clients ask for permission before each request.
+  The server can be started from the command line with ``python -m psaw.ratelimit``.
+"""
+import logging
+import mmap
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from .PushshiftAPI import RateLimitCache
+
+try:
+    import fcntl
+
+    def _lock_file(fd):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock_file(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+except ImportError:
+    import msvcrt
+
+    def _lock_file(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+
+    def _unlock_file(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+log = logging.getLogger(__name__)
+
+
+class RateLimiter(object):
+    """
+    Base RateLimiter class
+
+    """
+    def try_acquire(self):
+        """
+        Take a request slot if one is available
+
+        :return: float
+            0 if the request may proceed, else seconds to wait before trying again
+        """
+        raise NotImplementedError
+
+    def acquire(self):
+        """
+        Block until a request slot is available, then take it
+
+        """
+        while True:
+            interval = self.try_acquire()
+            if interval == 0:
+                return
+            log.debug("Imposing rate limit, sleeping for %s" % interval)
+            time.sleep(interval)
+
+
+class FileRateLimiter(RateLimiter):
+    """
+    Token bucket shared by all processes on a host that use the same `path`.
+
+    Tokens accrue at `n` per `t` seconds, up to `burst`. The default burst of 1 spaces
+    requests evenly, so no window of `t` seconds ever sees more than `n` requests.
+
+    :param path: Location of the bucket file. Created if missing.
+    :type path: str
+
+    :param n: Number of requests allowed per `t` seconds.
+    :type n: int
+
+    :param t: Length of the rate limit period in seconds, defaults to 60.
+    :type t: int or float, optional
+
+    :param burst: Maximum number of requests that may be issued back-to-back after an idle period, defaults to 1.
+    :type burst: int, optional
+    """
+    _state = struct.Struct('dd') # tokens, time of last update
+
+    def __init__(self, path, n, t=60, burst=1):
+        self.path = path
+        self.n = n
+        self.t = t
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        _lock_file(self._fd)
+        try:
+            if os.fstat(self._fd).st_size < self._state.size:
+                os.ftruncate(self._fd, self._state.size)
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                os.write(self._fd, self._state.pack(burst, time.time()))
+        finally:
+            _unlock_file(self._fd)
+        self._mmap = mmap.mmap(self._fd, self._state.size)
+
+    def try_acquire(self):
+        rate = self.n / self.t
+        with self._lock:
+            _lock_file(self._fd)
+            try:
+                tokens, last = self._state.unpack(self._mmap[:self._state.size])
+                now = time.time()
+                tokens = min(self.burst, tokens + max(now - last, 0) * rate)
+                if tokens >= 1:
+                    tokens -= 1
+                    interval = 0
+                else:
+                    interval = (1 - tokens) / rate
+                self._mmap[:self._state.size] = self._state.pack(tokens, now)
+            finally:
+                _unlock_file(self._fd)
+        return interval
+
+    def close(self):
+        self._mmap.close()
+        os.close(self._fd)
+
+
+class _GrantHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if line.strip() != b'acquire':
+                break
+            interval = self.server.limiter.try_acquire()
+            self.wfile.write('{!r}\n'.format(float(interval)).encode('ascii'))
+
+
+class RateLimitServer(object):
+    """
+    Coordinator granting request slots to :class:`SocketRateLimiter` clients, enforcing
+    the same sliding window as :class:`RateLimitCache` across all of them.
+
+    :param address: Path of a Unix domain socket, or a ``(host, port)`` tuple for TCP.
+    :type address: str or tuple
+
+    :param n: Number of requests allowed per `t` seconds.
+    :type n: int
+
+    :param t: Length of the rate limit period in seconds, defaults to 60.
+    :type t: int or float, optional
+    """
+    def __init__(self, address, n, t=60):
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = socketserver.ThreadingUnixStreamServer(address, _GrantHandler)
+        else:
+            self.server = socketserver.ThreadingTCPServer(tuple(address), _GrantHandler)
+        self.server.daemon_threads = True
+        self.server.limiter = RateLimitCache(n=n, t=t)
+        self.address = self.server.server_address
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self):
+        """
+        Serve from a background daemon thread
+
+        :return: threading.Thread
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SocketRateLimiter(RateLimiter):
+    """
+    Client of a :class:`RateLimitServer`. Safe to share between threads.
+
+    :param address: Address the server listens on.
+    :type address: str or tuple
+
+    :param timeout: Socket timeout in seconds, defaults to 10.
+    :type timeout: int or float, optional
+    """
+    def __init__(self, address, timeout=10):
+        self.address = address
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._rfile = None
+
+    def _connect(self):
+        family = socket.AF_UNIX if isinstance(self.address, str) else socket.AF_INET
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.settimeout(self.timeout)
+        self._sock.connect(self.address if isinstance(self.address, str) else tuple(self.address))
+        self._rfile = self._sock.makefile('rb')
+
+    def try_acquire(self):
+        with self._lock:
+            # Reconnect once if the coordinator was restarted.
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._sock.sendall(b'acquire\n')
+                    line = self._rfile.readline()
+                    if not line:
+                        raise ConnectionError("Rate limit server closed the connection.")
+                    return float(line)
+                except OSError:
+                    self.close()
+                    if attempt > 0:
+                        raise
+
+    def close(self):
+        if self._sock is not None:
+            self._rfile.close()
+            self._sock.close()
+        self._sock = None
+        self._rfile = None
+
+
+def serve(args=None):
+    """
+    Command line entry point running a :class:`RateLimitServer`
+
+    :param args: list[str]
+        command line arguments, defaults to ``sys.argv[1:]``
+    """
+    import click
+
+    @click.command(context_settings=dict(max_content_width=100))
+    @click.option("--address", required=True,
+                  help="unix socket path, or host:port to listen on TCP")
+    @click.option("--per-minute", "n", type=int, required=True,
+                  help="requests allowed per minute across all clients")
+    def command(address, n):
+        """
+        run a rate limit coordinator for SocketRateLimiter clients
+
+        """
+        if ':' in address:
+            host, port = address.rsplit(':', 1)
+            address = (host, int(port))
+        server = RateLimitServer(address, n=n)
+        click.echo("serving {} requests per minute on {}".format(n, server.address))
+        server.serve_forever()
+
+    return command(args)
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,191 @@
+"""
+HTTP transports used by :class:`psaw.PushshiftAPIMinimal` to issue GET requests.
+
+A transport only needs a ``get(url, params, stream)`` method returning an object with
+``status_code``, ``url``, ``content`` and ``text`` attributes and an ``iter_content`` method, and a
+``connection_errors`` tuple of exception types that should be retried.
+"""
+from urllib.parse import urlencode
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def request_key(url, params=None):
+    """
+    Normalized string identifying a GET request, independent of parameter order
+
+    :param url: str
+    :param params: dict
+    :return: str
+    """
+    if not params:
+        return url
+    items = []
+    for k in sorted(params):
+        v = params[k]
+        if isinstance(v, (list, tuple)):
+            v = ','.join(str(x) for x in v)
+        items.append((k, v))
+    return url + '?' + urlencode(items)
+
+
+def _accept_encoding():
+    encodings = ['gzip', 'deflate']
+    try:
+        import brotli
+        encodings.append('br')
+    except ImportError:
+        try:
+            import brotlicffi
+            encodings.append('br')
+        except ImportError:
+            pass
+    return ', '.join(encodings)
+
+
+class Response(object):
+    """
+    Minimal stand-in for :class:`requests.Response`
+
+    """
+    def __init__(self, status_code=200, content=b'', url='', headers=None):
+        if isinstance(content, str):
+            content = content.encode('utf8')
+        self.status_code = status_code
+        self.content = content
+        self.url = url
+        self.headers = headers or {}
+
+    @property
+    def text(self):
+        return self.content.decode('utf8')
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i+chunk_size]
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class Transport(object):
+    """
+    Base Transport class
+
+    """
+    connection_errors = (ConnectionError,)
+
+    def get(self, url, params=None, stream=False):
+        """
+        Issue a GET request
+
+        :param url: str
+        :param params: dict
+        :param stream: bool
+            if True, the body may be read incrementally via ``response.iter_content``
+        :return: response
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Release any resources held by the transport
+
+        """
+        pass
+
+
+class RequestsTransport(Transport):
+    """
+    Pooled keep-alive transport built on :class:`requests.Session`. Connections are reused
+    across requests, and responses are negotiated with gzip (and brotli, if installed).
+
+    :param pool_size: Maximum number of connections kept alive per host, defaults to 10.
+        Should be at least the number of threads sharing the transport.
+    :type pool_size: int, optional
+
+    :param proxies: Proxies passed through to ``requests``.
+    :type proxies: dict, optional
+    """
+    def __init__(self, pool_size=10, proxies=None):
+        # Imported here rather than with the module, as requests is slow to import.
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.connection_errors = (requests.ConnectionError,)
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Accept-Encoding'] = _accept_encoding()
+        if proxies:
+            self.session.proxies.update(proxies)
+
+    def get(self, url, params=None, stream=False):
+        return self.session.get(url, params=params, stream=stream)
+
+    def close(self):
+        self.session.close()
+
+
+class ReplayTransport(Transport):
+    """
+    In-memory transport serving canned responses, e.g. for tests.
+
+    :param responses: Mapping from :func:`request_key` (or a bare URL, matching any
+        parameters) to a response. A response may be a dict (served as JSON with status 200),
+        a :class:`Response`, an exception instance to raise, or a list of these to be served
+        in order, the last one repeating.
+    :type responses: dict
+
+    Every request made is appended to ``requests`` as a ``(url, params)`` tuple.
+    """
+    def __init__(self, responses=None):
+        self.responses = dict(responses or {})
+        self.requests = []
+
+    def add(self, url, response, params=None):
+        self.responses[request_key(url, params)] = response
+
+    def get(self, url, params=None, stream=False):
+        self.requests.append((url, dict(params or {})))
+        key = request_key(url, params)
+        if key not in self.responses:
+            key = url
+        if key not in self.responses:
+            return Response(404, b'{}', request_key(url, params))
+
+        response = self.responses[key]
+        if isinstance(response, list):
+            response = response.pop(0) if len(response) > 1 else response[0]
+        if isinstance(response, Exception):
+            raise response
+        if not isinstance(response, Response):
+            response = Response(200, json.dumps(response), request_key(url, params))
+        return response
+
+
+class RecordingTransport(Transport):
+    """
+    Wraps another transport and keeps every response, so a live session can be replayed
+    later with ``ReplayTransport(recorder.responses)``.
+
+    :param transport: Transport to record.
+    :type transport: :class:`Transport`
+    """
+    def __init__(self, transport):
+        self.transport = transport
+        self.connection_errors = transport.connection_errors
+        self.responses = {}
+
+    def get(self, url, params=None, stream=False):
+        response = self.transport.get(url, params=params)
+        self.responses[request_key(url, params)] = Response(
+            response.status_code, response.content, response.url)
+        return response
+
+    def close(self):
+        self.transport.close()
@@ -1,7 +1,5 @@
 import itertools
-import dateutil.parser as dp
 import re
-import click
 
 
 def validate_fields(item, fields=None):
@@ -108,6 +106,8 @@ def string_to_epoch(s):
         if re.search('^[0-9]+[smhd]$', s):
             return s
 
+        import click
+        import dateutil.parser as dp
         try:
             s = dp.parse(s).timestamp()
             s = int(s)
@@ -1,7 +1,57 @@
+from collections import OrderedDict
 import json
 import csv
+import gzip
+import logging
+from operator import itemgetter
+import os
+import queue
+import re
+import threading
 
-from .utilities import slice_dict
+log = logging.getLogger(__name__)
+
+
+def _getter(fields):
+    """itemgetter returning a tuple of `fields`, even for a single field"""
+    if len(fields) == 1:
+        field = fields[0]
+        return lambda d: (d[field],)
+    return itemgetter(*fields)
+
+
+def _projection(fields):
+    """
+    Compile `fields` into a function returning the dict of those fields present in a thing.
+    Things usually have every field, which is a single itemgetter call.
+    """
+    fields = tuple(fields)
+    getter = _getter(fields)
+
+    def project(d):
+        try:
+            return dict(zip(fields, getter(d)))
+        except KeyError:
+            return {k: d[k] for k in fields if k in d}
+    return project
+
+
+def _row_projection(fields, missing=''):
+    """As :func:`_projection`, returning a tuple of values with `missing` for absent fields."""
+    fields = tuple(fields)
+    getter = _getter(fields)
+
+    def project(d):
+        try:
+            return getter(d)
+        except KeyError:
+            return tuple(d.get(k, missing) for k in fields)
+    return project
+
+
+def _has_content(fp):
+    """Whether `fp` names an existing, non-empty file"""
+    return not hasattr(fp, 'write') and os.path.exists(fp) and os.path.getsize(fp) > 0
 
 
 class Writer(object):
@@ -12,6 +62,8 @@ class Writer(object):
     def __init__(self, fields):
         self.fields = fields
         self.fp = None
+        self._resumed = False
+        self._project = _projection(fields)
 
     def header(self):
         """
@@ -27,15 +79,36 @@ class Writer(object):
         """
         pass
 
-    def open(self, fp):
+    def open(self, fp, append=False):
         """
         Open output file for writing if necessary
 
+        :param append: bool
+            continue an existing file rather than overwriting it
+
         """
         if hasattr(fp, 'write'):
             self.fp = fp
         else:
-            self.fp = open(fp, 'w', encoding='utf8', newline='')
+            self.fp = open(fp, 'a' if append else 'w', encoding='utf8', newline='')
+
+    def flush(self):
+        """
+        Flush buffered output to disk
+
+        """
+        if self.fp is not None and not self.fp.closed:
+            self.fp.flush()
+
+    def write_many(self, objs):
+        """
+        Write a batch of things
+
+        :param objs: list of dict
+
+        """
+        for obj in objs:
+            self.write(obj)
 
     def close(self):
         """
@@ -64,10 +137,10 @@ class JsonWriter(Writer):
             self.delimiter = self.delimiter + '\n'
         else:
             self.indent = None
+        self._encode = json.JSONEncoder(indent=self.indent).encode
 
     def write(self, obj):
-        obj = slice_dict(obj, self.fields)
-        json.dump(obj, self.fp, indent=self.indent)
+        self.fp.write(self._encode(self._project(obj)))
         self.items += 1
 
 
@@ -77,22 +150,50 @@ class JsonBatchWriter(JsonWriter):
 
     """
 
+    def open(self, fp, append=False):
+        self._resumed = append and _has_content(fp)
+        self._has_items = self._resumed
+        if self._resumed:
+            # reopen the json list by dropping its closing bracket. If the last byte isn't one,
+            # the footer was never written (e.g. the process was killed), so append as is.
+            with open(fp, 'rb+') as f:
+                end = f.seek(0, os.SEEK_END)
+                last = b''
+                while end > 0:
+                    f.seek(end - 1)
+                    last = f.read(1)
+                    if not last.isspace():
+                        break
+                    end -= 1
+                if last == b']':
+                    f.truncate(end - 1)
+                    f.seek(end - 2)
+                    last = f.read(1) if end > 1 else b''
+                # nothing after the opening bracket: the list is still empty
+                self._has_items = last != b'['
+        super().open(fp, append=append)
+
     def header(self):
-        self.fp.write('[')
+        if not self._resumed:
+            self.fp.write('[')
 
     def footer(self):
         self.fp.write(']')
 
     def write(self, obj):
-        obj = slice_dict(obj, self.fields)
+        self.write_many([obj])
 
-        if self.items > 0:
+    def write_many(self, objs):
+        if not objs:
+            return
+        encode, project = self._encode, self._project
+        if self.items > 0 or self._has_items:
             # we've already written something, so
             # append a comma to make this a json list
             self.fp.write(self.delimiter)
 
-        json.dump(obj, self.fp, indent=self.indent)
-        self.items += 1
+        self.fp.write(self.delimiter.join([encode(project(obj)) for obj in objs]))
+        self.items += len(objs)
 
 
 class CsvWriter(Writer):
@@ -101,25 +202,31 @@ class CsvWriter(Writer):
 
     """
     def __init__(self, fields, delimiter=',', **kwargs):
+        # fix the column order, fields may be a set
+        fields = list(fields)
         super().__init__(fields=fields)
         self.items = 0
         self.writer = None
         self.delimiter = delimiter
+        self._project = _row_projection(fields)
 
-    def open(self, fp):
-        super().open(fp)
-        self.writer = csv.DictWriter(self.fp,
-                                     delimiter=self.delimiter,
-                                     fieldnames=self.fields)
+    def open(self, fp, append=False):
+        self._resumed = append and _has_content(fp)
+        super().open(fp, append=append)
+        self.writer = csv.writer(self.fp, delimiter=self.delimiter)
 
     def header(self):
-        self.writer.writeheader()
+        if not self._resumed:
+            self.writer.writerow(self.fields)
 
     def write(self, obj):
-        obj = slice_dict(obj, self.fields)
-        self.writer.writerow(obj)
+        self.writer.writerow(self._project(obj))
         self.items += 1
 
+    def write_many(self, objs):
+        self.writer.writerows(map(self._project, objs))
+        self.items += len(objs)
+
 
 class CsvBatchWriter(CsvWriter):
     """
@@ -127,3 +234,509 @@ class CsvBatchWriter(CsvWriter):
     """
     # defined just for consistency with Json/JsonBatch
     pass
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression requires zstandard to be installed.")
+    return zstandard
+
+
+# A {shard} replacement field, left for NdjsonWriter to fill when partition paths are formatted.
+_shard_field = re.compile(r'\{shard(?:[!:][^{}]*)?\}')
+
+_compression_extensions = {'.gz': 'gzip', '.gzip': 'gzip', '.zst': 'zstd', '.zstd': 'zstd'}
+
+
+class NdjsonWriter(Writer):
+    """
+    Output comments/submissions as newline delimited JSON, one thing per line, optionally
+    compressed and split into shards
+
+    Output file names may contain a ``{shard}`` replacement field, e.g.
+    ``out-{shard:05d}.ndjson.zst``, which is filled with the shard number. A new shard is started
+    after `max_records` things or `max_bytes` bytes of uncompressed output. When appending,
+    writing continues in a new shard after the last existing one.
+
+    :param compression: 'gzip', 'zstd' (requires ``zstandard``) or None, defaults to inferring it from the file extension.
+    :param max_records: int
+    :param max_bytes: int
+    :param level: compression level, defaults to the compressor's default.
+
+    """
+    def __init__(self, fields, compression=None, max_records=None, max_bytes=None, level=None, **kwargs):
+        super().__init__(fields=fields)
+        self.compression = compression
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.level = level
+        self.items = 0
+        self.shard = 0
+        self._raw = None
+
+    def open(self, fp, append=False):
+        self.template = fp
+        self.shard = 0
+        self._sharded = not hasattr(fp, 'write') and '{shard' in str(fp)
+        if (self.max_records or self.max_bytes) and not self._sharded:
+            raise ValueError("Output file name needs a {shard} field to split output into shards.")
+        self._compression = self.compression
+        if self._compression is None and not hasattr(fp, 'write'):
+            self._compression = _compression_extensions.get(os.path.splitext(str(fp))[1])
+        if self._sharded and append:
+            while _has_content(self._path()):
+                self.shard += 1
+            append = False
+        self._open_shard(append)
+
+    def _path(self):
+        if self._sharded:
+            return str(self.template).format(shard=self.shard)
+        return self.template
+
+    def _open_shard(self, append=False):
+        if hasattr(self.template, 'write'):
+            self._raw = getattr(self.template, 'buffer', self.template)
+        else:
+            self._raw = open(self._path(), 'ab' if append else 'wb')
+        self.fp = self._compressor(self._raw)
+        self._shard_records = 0
+        self._shard_bytes = 0
+
+    def _compressor(self, raw):
+        if self._compression == 'gzip':
+            return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=self.level or 6)
+        if self._compression == 'zstd':
+            zstandard = _import_zstandard()
+            return zstandard.ZstdCompressor(level=self.level or 3).stream_writer(raw, closefd=False)
+        if self._compression is not None:
+            raise ValueError("Unknown compression: {}".format(self._compression))
+        return raw
+
+    def _full(self, n_bytes):
+        """Whether the current shard is too full to take another `n_bytes` line"""
+        return self._shard_records > 0 and (
+            (self.max_records and self._shard_records >= self.max_records) or
+            (self.max_bytes and self._shard_bytes + n_bytes > self.max_bytes))
+
+    def write(self, obj):
+        self.write_many([obj])
+
+    def write_many(self, objs):
+        if not objs:
+            return
+        project = self._project
+        lines = [json.dumps(project(obj)) for obj in objs]
+        if not (self.max_records or self.max_bytes):
+            self.fp.write(('\n'.join(lines) + '\n').encode('utf8'))
+            self.items += len(lines)
+            return
+        lines = [(line + '\n').encode('utf8') for line in lines]
+        chunk = []
+        for line in lines:
+            if self._full(len(line)):
+                self.fp.write(b''.join(chunk))
+                chunk = []
+                self._close_shard()
+                self.shard += 1
+                self._open_shard()
+            chunk.append(line)
+            self._shard_records += 1
+            self._shard_bytes += len(line)
+            self.items += 1
+        self.fp.write(b''.join(chunk))
+
+    def flush(self):
+        """
+        Complete the current gzip member or zstd frame, so that everything written so far
+        can be decompressed even if the process dies before the file is closed.
+
+        """
+        if self._compression == 'gzip':
+            self.fp.close()
+            self.fp = self._compressor(self._raw)
+        elif self._compression == 'zstd':
+            self.fp.flush(_import_zstandard().FLUSH_FRAME)
+        self._raw.flush()
+
+    def _close_shard(self):
+        if self.fp is not self._raw:
+            self.fp.close()
+        if hasattr(self.template, 'write'):
+            self._raw.flush()
+        else:
+            self._raw.close()
+
+    def close(self):
+        self._close_shard()
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Arrow and Parquet output require pyarrow to be installed.")
+    return pyarrow
+
+
+# Column types for fields whose values don't share one, so that they needn't be inferred.
+# Reddit's `edited` is False, or the time of the edit.
+DEFAULT_COLUMN_TYPES = {'edited': 'float64'}
+
+
+def _arrow_column(pa, values, type=None):
+    """
+    Convert a column of values to an Arrow array, of `type` if given. Nested values are stored
+    as JSON strings, as are columns whose values don't share a type. Booleans in a numeric
+    column are stored as 0 and 1. Raises ValueError if the values can't be converted to `type`
+    without losing data.
+    """
+    values = [json.dumps(v) if isinstance(v, (dict, list)) else v for v in values]
+    if type is not None and pa.types.is_string(type):
+        return pa.array([v if v is None or isinstance(v, str) else json.dumps(v) for v in values], type)
+    if type is not None and (pa.types.is_integer(type) or pa.types.is_floating(type)):
+        values = [int(v) if isinstance(v, bool) else v for v in values]
+    try:
+        # infer, then cast safely: pa.array(values, type) silently turns 3.7 into 3 or 1.5 into True
+        array = pa.array(values)
+        if type is not None and array.type != type:
+            if pa.types.is_boolean(type) and not pa.types.is_null(array.type):
+                # arrow casts any nonzero number to True, even "safely"
+                raise pa.ArrowInvalid("Can't cast {} to bool".format(array.type))
+            array = array.cast(type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        if type is None:
+            return _arrow_column(pa, values, pa.string())
+        raise ValueError("Values don't fit the column type {}: {}. Declare the column's type "
+                         "in column_types.".format(type, values[:3]))
+    if pa.types.is_null(array.type):
+        return pa.array(values, pa.string())
+    return array
+
+
+class ArrowWriter(Writer):
+    """
+    Output comments/submissions in Arrow IPC (Feather) format, all to a single file
+
+    Rows are buffered by column and written as record batches of `row_group_size` rows, so
+    memory use is bounded by the batch size rather than the number of things. Types of the
+    columns in `column_types` are fixed up front; the rest are inferred from the first batch.
+    A later batch whose values don't fit an inferred type (e.g. a float in a column that was
+    all booleans) raises ValueError rather than being cast, so declare the types of fields
+    whose values vary. Requires ``pyarrow``.
+
+    :param column_types: pyarrow types, or their names such as 'float64' or 'string', by field.
+        Merged over :data:`DEFAULT_COLUMN_TYPES`, which stores ``edited`` as a float (0 if not edited).
+    :type column_types: dict, optional
+    """
+    def __init__(self, fields, row_group_size=100000, compression='zstd', column_types=None, **kwargs):
+        super().__init__(fields=fields)
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.column_types = dict(DEFAULT_COLUMN_TYPES, **(column_types or {}))
+        self._types = None
+        self.items = 0
+        self.schema = None
+        self.writer = None
+        self._columns = {field: [] for field in fields}
+        self._buffered = 0
+
+    def _open_writer(self, pa, schema):
+        options = pa.ipc.IpcWriteOptions(compression=self.compression)
+        return pa.ipc.new_file(self.fp, schema, options=options)
+
+    def open(self, fp, append=False):
+        if append and _has_content(fp):
+            raise ValueError("{} can't append to an existing file.".format(type(self).__name__))
+        pa = _import_pyarrow()
+        # Resolved now, so a bad type name fails before anything is fetched.
+        self._types = {field: pa.type_for_alias(name) if isinstance(name, str) else name
+                       for field, name in self.column_types.items()}
+        self.fp = fp
+
+    def write(self, obj):
+        for field, column in self._columns.items():
+            column.append(obj.get(field))
+        self._buffered += 1
+        self.items += 1
+        if self._buffered >= self.row_group_size:
+            self._write_batch()
+
+    def write_many(self, objs):
+        start = 0
+        while start < len(objs):
+            chunk = objs[start:start + self.row_group_size - self._buffered]
+            for field, column in self._columns.items():
+                column.extend([obj.get(field) for obj in chunk])
+            self._buffered += len(chunk)
+            self.items += len(chunk)
+            start += len(chunk)
+            if self._buffered >= self.row_group_size:
+                self._write_batch()
+
+    def _write_batch(self):
+        pa = _import_pyarrow()
+        if self.schema is None:
+            arrays = [_arrow_column(pa, self._columns[field], self._types.get(field)) for field in self.fields]
+            self.schema = pa.schema([pa.field(field, array.type) for field, array in zip(self.fields, arrays)])
+        else:
+            arrays = [_arrow_column(pa, self._columns[field], self.schema.field(field).type)
+                      for field in self.fields]
+        if self.writer is None:
+            self.writer = self._open_writer(pa, self.schema)
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        for column in self._columns.values():
+            column.clear()
+        self._buffered = 0
+
+    def flush(self):
+        """
+        Row groups are only written once full, and the file is unreadable until closed,
+        so there is nothing to flush.
+
+        """
+        pass
+
+    def close(self):
+        if self._buffered or self.writer is None:
+            self._write_batch()
+        self.writer.close()
+        self.writer = None
+
+
+class ParquetWriter(ArrowWriter):
+    """
+    Output comments/submissions in Parquet format, all to a single file
+
+    Rows are buffered and written as compressed row groups of `row_group_size` rows, as for
+    :class:`ArrowWriter`. Requires ``pyarrow``.
+
+    """
+    def _open_writer(self, pa, schema):
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(self.fp, schema, compression=self.compression)
+
+
+class BufferedWriter(object):
+    """
+    Wraps a writer to hand it things in batches of `batch_size` via ``write_many``, optionally
+    from a background thread so that serialization and disk I/O overlap with fetching.
+
+    :meth:`flush` writes out every thing received so far before flushing the wrapped writer, so
+    it can still be used as a checkpoint's ``on_save``. Errors raised by the background thread
+    are raised again by the next call to :meth:`write`, :meth:`flush` or :meth:`close`.
+
+    :param writer: Writer to wrap.
+    :type writer: Writer
+
+    :param batch_size: Number of things per ``write_many`` call, defaults to 1000.
+    :type batch_size: int, optional
+
+    :param background: Write from a background thread, defaults to False.
+    :type background: bool, optional
+
+    :param max_pending: Number of batches that may wait for the background thread, defaults to 4.
+    :type max_pending: int, optional
+    """
+    def __init__(self, writer, batch_size=1000, background=False, max_pending=4):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.background = background
+        self._batch = []
+        self._error = None
+        self._queue = None
+        self._thread = None
+        if background:
+            self._queue = queue.Queue(maxsize=max_pending)
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def __getattr__(self, name):
+        if name == 'writer':
+            raise AttributeError(name)
+        return getattr(self.writer, name)
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            try:
+                if batch is None:
+                    return
+                # after an error, keep draining the queue so the producer doesn't block
+                if self._error is None:
+                    self.writer.write_many(batch)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _submit(self):
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        if self._thread is not None:
+            self._queue.put(batch)
+        else:
+            self.writer.write_many(batch)
+
+    def _drain(self):
+        """Write out the current batch and wait for the background thread to catch up"""
+        self._submit()
+        if self._thread is not None:
+            self._queue.join()
+
+    def open(self, fp, append=False):
+        self.writer.open(fp, append=append)
+
+    def header(self):
+        self.writer.header()
+
+    def write(self, obj):
+        self._check()
+        self._batch.append(obj)
+        if len(self._batch) >= self.batch_size:
+            self._submit()
+
+    def write_many(self, objs):
+        self._check()
+        self._batch.extend(objs)
+        if len(self._batch) >= self.batch_size:
+            self._submit()
+
+    def flush(self):
+        self._drain()
+        self._check()
+        self.writer.flush()
+
+    def footer(self):
+        self._drain()
+        if self._error is None:
+            self.writer.footer()
+
+    def close(self):
+        """
+        Write out everything received, stop the background thread and close the wrapped writer
+
+        """
+        try:
+            self._drain()
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+        finally:
+            self.writer.close()
+        self._check()
+
+
+class PartitionedWriter(object):
+    """
+    Appends things to the partition file named by filling a template with their fields,
+    e.g. ``'out/{subreddit}.csv'``, with a writer per partition made by `make_writer`.
+
+    At most `max_open` partitions are kept open. The least recently written is closed to make
+    room for another and appended to if it is written again, so the wrapped writer must support
+    ``append`` (Arrow and Parquet writers don't). Directories are created once per path.
+
+    :param make_writer: Called with no arguments to make the writer for a new partition.
+    :type make_writer: callable
+
+    :param max_open: Number of partition files kept open, defaults to 128.
+    :type max_open: int, optional
+    """
+    def __init__(self, make_writer, max_open=128):
+        self.make_writer = make_writer
+        self.max_open = max_open
+        self.template = None
+        self.items = 0
+        self._append = False
+        self._open = OrderedDict()
+        self._paths = set()
+        self._dirs = set()
+
+    def open(self, template, append=False):
+        """
+        Set the partition template. Partition files that already exist are appended to if
+        `append`, else overwritten the first time they are written. A ``{shard}`` field is
+        left in partition paths for a sharding :class:`NdjsonWriter` to fill.
+
+        :param template: str
+        :param append: bool
+        """
+        self.template = _shard_field.sub(lambda match: '{' + match.group(0) + '}', template)
+        self._append = append
+
+    def header(self):
+        pass
+
+    def footer(self):
+        pass
+
+    def path(self, obj):
+        """
+        Partition file for `obj`
+
+        :param obj: dict
+        :return: str
+        """
+        return self.template.format(**obj)
+
+    def _writer(self, path):
+        writer = self._open.get(path)
+        if writer is not None:
+            self._open.move_to_end(path)
+            return writer
+        if len(self._open) >= self.max_open:
+            _, evicted = self._open.popitem(last=False)
+            evicted.footer()
+            evicted.close()
+        parent = os.path.dirname(path)
+        if parent and parent not in self._dirs:
+            os.makedirs(parent, exist_ok=True)
+            self._dirs.add(parent)
+        writer = self.make_writer()
+        writer.open(path, append=self._append or path in self._paths)
+        writer.header()
+        self._paths.add(path)
+        self._open[path] = writer
+        return writer
+
+    def write(self, obj):
+        self._writer(self.path(obj)).write(obj)
+        self.items += 1
+
+    def write_many(self, objs):
+        partitions = OrderedDict()
+        for obj in objs:
+            partitions.setdefault(self.path(obj), []).append(obj)
+        for path, batch in partitions.items():
+            self._writer(path).write_many(batch)
+        self.items += len(objs)
+
+    @property
+    def partitions(self):
+        """Paths of every partition written to"""
+        return sorted(self._paths)
+
+    def flush(self):
+        for writer in self._open.values():
+            writer.flush()
+
+    def close(self):
+        """
+        Finish and close every open partition
+
+        """
+        while self._open:
+            _, writer = self._open.popitem(last=False)
+            try:
+                writer.footer()
+            finally:
+                writer.close()